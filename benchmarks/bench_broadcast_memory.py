@@ -0,0 +1,118 @@
+"""
+Бенчмарк памяти рассылки: синтетическая БД на миллион пользователей
+Сравнивает прежнюю выборку получателей (все пользователи ORM-объектами через .all())
+с services.broadcast.iter_recipient_chunks (Telegram ID порциями по users.id)
+Каждый замер - отдельный процесс, чтобы пиковый RSS не смешивался между путями
+
+Запуск: python benchmarks/bench_broadcast_memory.py [--users 1000000] [--purchases 150000]
+"""
+
+import argparse
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import common
+import config
+
+MODES = ("old", "new")
+RECIPIENTS = ("all", "buyers", "non_buyers")
+
+
+def old_recipients(db, recipients: str) -> list:
+    """Получатели как до порционной выборки: все пользователи фильтра ORM-объектами"""
+    from database import Purchase, User
+    
+    if recipients == "all":
+        return db.query(User).filter(User.is_blocked == False).all()
+    if recipients == "buyers":
+        return db.query(User).join(Purchase).filter(User.is_blocked == False).distinct().all()
+    buyers_ids = db.query(Purchase.user_id).distinct().subquery()
+    return db.query(User).filter(
+        User.is_blocked == False,
+        ~User.id.in_(db.query(buyers_ids))
+    ).all()
+
+
+def build(path: str, users: int, purchases: int):
+    """Синтетическая БД: users пользователей и purchases покупок случайных пользователей"""
+    config.DATABASE_PATH = path
+    from database import init_db
+    init_db()
+    
+    now = datetime.now().isoformat(" ")
+    connection = sqlite3.connect(path)
+    try:
+        connection.executemany(
+            "INSERT INTO users (user_id, username, first_name, balance, total_deposits, is_blocked, "
+            "block_type, is_subscribed, is_reachable, created_at, updated_at) "
+            "VALUES (?, ?, ?, 0, 0, 0, 'normal', 0, 1, ?, ?)",
+            ((1000000000 + i, f"user{i}", f"User {i}", now, now) for i in range(users))
+        )
+        connection.execute(
+            "INSERT INTO items (name, price, product_type, stock_count, created_at, updated_at) "
+            "VALUES ('bench', 1.0, 'string', 0, ?, ?)", (now, now)
+        )
+        rng = random.Random(1)
+        connection.executemany(
+            "INSERT INTO purchases (user_id, item_id, quantity, total_price, created_at) VALUES (?, 1, 1, 1.0, ?)",
+            ((rng.randint(1, users), now) for _ in range(purchases))
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def measure(path: str, mode: str, recipients: str):
+    """Один замер в отдельном процессе: выводит получателей, секунды и пиковый RSS"""
+    config.DATABASE_PATH = path
+    from database import SessionLocal
+    from services.broadcast import iter_recipient_chunks
+    
+    started = time.perf_counter()
+    count = 0
+    if mode == "old":
+        db = SessionLocal()
+        try:
+            for user in old_recipients(db, recipients):
+                count += user.user_id > 0
+        finally:
+            db.close()
+    else:
+        for _, chat_ids in iter_recipient_chunks(recipients):
+            count += len(chat_ids)
+    print(count, time.perf_counter() - started, common.rss_mib())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--purchases", type=int, default=150000)
+    parser.add_argument("--measure", nargs=3, metavar=("DB", "MODE", "RECIPIENTS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.measure:
+        measure(*args.measure)
+        return
+    
+    path = str(common.TEMP_DIR / "broadcast.db")
+    started = time.perf_counter()
+    build(path, args.users, args.purchases)
+    print(f"БД: {args.users} пользователей, {args.purchases} покупок ({time.perf_counter() - started:.1f} s)")
+    print(f"Порция: {config.BROADCAST_CHUNK_SIZE}")
+    
+    for recipients in RECIPIENTS:
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, __file__, "--measure", path, mode, recipients],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            count, elapsed, rss = int(output[0]), float(output[1]), float(output[2])
+            print(f"{recipients:10} {mode:3}  получателей={count:8}  {elapsed:6.1f} s  RSS {rss:7.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
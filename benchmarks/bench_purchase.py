@@ -0,0 +1,128 @@
+"""
+Бенчмарк одновременных покупок: сотни покупок одной позиции параллельно
+Сравнивает прежний путь (проверка наличия и баланса чтением, затем запись)
+с services.purchase.buy_products (условные UPDATE ... RETURNING)
+Проверяет, что товара не продано больше, чем было, и ни одна строка не выдана дважды
+
+Запуск: python benchmarks/bench_purchase.py [--users 300] [--stock 200] [--buys 300] [--threads 12]
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import common  # noqa: F401 - временная БД
+from database import init_db, SessionLocal, Item, Product, Purchase, PurchaseProduct, User
+from services.purchase import buy_products
+import utils
+
+
+def old_buy_products(db, user, item, quantity):
+    """Покупка как до атомарного пути: чтение непроданных строк и баланса, затем запись"""
+    products = db.query(Product).filter(
+        Product.item_id == item.id,
+        Product.is_sold == False
+    ).limit(quantity).all()
+    if len(products) < quantity:
+        return 'out_of_stock', None, [], None
+    
+    total_price = item.price * quantity
+    if user.balance < total_price:
+        return 'insufficient_balance', None, [], None
+    
+    purchase = Purchase(user_id=user.id, item_id=item.id, quantity=quantity, total_price=total_price)
+    db.add(purchase)
+    user.balance -= total_price
+    for product in products:
+        product.is_sold = True
+        product.sold_at = datetime.now()
+    purchase.product_id = products[0].id
+    stock_left = utils.change_item_stock(db, item.id, -quantity)
+    db.commit()
+    utils.log_action(db, "purchase", user_id=user.id, data={"item_id": item.id, "quantity": quantity})
+    return None, purchase, products, stock_left
+
+
+def prepare(users: int, stock: int) -> tuple:
+    """Позиция с stock строками и users покупателей с балансом на одну покупку"""
+    db = SessionLocal()
+    try:
+        for model in (PurchaseProduct, Purchase, Product, Item, User):
+            db.query(model).delete()
+        item = Item(name="bench", price=1.0, product_type='string', stock_count=stock)
+        db.add(item)
+        db.flush()
+        db.add_all([Product(item_id=item.id, content=f"line{i}") for i in range(stock)])
+        db.add_all([User(user_id=100000 + i, balance=1.0) for i in range(users)])
+        db.commit()
+        return item.id, [row[0] for row in db.query(User.id)]
+    finally:
+        db.close()
+
+
+def run(buy, args):
+    item_id, user_ids = prepare(args.users, args.stock)
+    delivered = []
+    errors = []
+    lock = threading.Lock()
+    
+    def worker(user_id):
+        db = SessionLocal()
+        try:
+            user = db.get(User, user_id)
+            item = db.get(Item, item_id)
+            error, purchase, products, _ = buy(db, user, item, 1)
+            if not error:
+                with lock:
+                    delivered.extend(p.content for p in products)
+        except Exception as e:
+            db.rollback()
+            errors.append(type(e).__name__)
+        finally:
+            db.close()
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        list(pool.map(worker, [user_ids[i % len(user_ids)] for i in range(args.buys)]))
+    elapsed = time.perf_counter() - started
+    
+    db = SessionLocal()
+    try:
+        sold = db.query(Product).filter(Product.is_sold == True).count()
+        purchases = db.query(Purchase).count()
+        stock_count = db.get(Item, item_id).stock_count
+        negative = db.query(User).filter(User.balance < 0).count()
+    finally:
+        db.close()
+    
+    duplicates = len(delivered) - len(set(delivered))
+    oversold = max(0, purchases - args.stock)
+    print(
+        f"{buy.__name__:17} {elapsed:6.2f} s  {purchases / elapsed:6.0f} покупок/с  "
+        f"покупок={purchases} продано строк={sold} stock_count={stock_count} "
+        f"перепродано={oversold} строк выдано дважды={duplicates} "
+        f"баланс<0={negative} ошибок={len(errors)}"
+    )
+    return oversold, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--stock", type=int, default=200)
+    parser.add_argument("--buys", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=12)
+    args = parser.parse_args()
+    
+    init_db()
+    print(f"Покупок: {args.buys}, в наличии: {args.stock}, потоков: {args.threads}")
+    run(old_buy_products, args)
+    oversold, duplicates = run(buy_products, args)
+    if oversold or duplicates:
+        raise SystemExit("buy_products: перепродажа или повторная выдача строк")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Бенчмарк загрузки строковых товаров из .txt: строк в секунду и пиковая память
+Сравнивает прежний путь (readlines целиком + ORM-объект на каждую строку, один commit)
+с services.products.import_product_lines (потоковое чтение, пачки INSERT OR IGNORE)
+Каждый замер - отдельный процесс со своей временной БД
+
+Запуск: python benchmarks/bench_upload.py [--lines 1000000]
+"""
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+
+import common
+import config
+
+MODES = ("old", "new")
+
+
+def old_import_product_lines(db, item_id: int, file_path) -> int:
+    """Загрузка как до потокового пути: файл в память целиком, товары по одному через ORM"""
+    from database import Product
+    import utils
+    
+    with open(file_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    
+    count = 0
+    for line in lines:
+        line = line.strip()
+        if line:
+            product = Product(
+                item_id=item_id,
+                content=line
+            )
+            db.add(product)
+            count += 1
+    
+    utils.change_item_stock(db, item_id, count)
+    db.commit()
+    return count
+
+
+def generate(file_path, lines: int):
+    """Файл логов: lines уникальных строк ~70 байт"""
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for i in range(lines):
+            f.write(f"login{i:09d}@example.com:password{i:09d}:token-{i * 7919 % 1000003:07d}-abcdef\n")
+
+
+def measure(file_path, mode: str):
+    """Один замер в отдельном процессе: выводит загруженные строки, секунды и пиковый RSS"""
+    from database import init_db, SessionLocal, Item
+    from services.products import import_product_lines
+    
+    init_db()
+    db = SessionLocal()
+    try:
+        item = Item(name="bench", price=1.0, product_type='string')
+        db.add(item)
+        db.commit()
+        
+        started = time.perf_counter()
+        if mode == "old":
+            added = old_import_product_lines(db, item.id, file_path)
+        else:
+            added, _ = asyncio.run(import_product_lines(db, item.id, file_path))
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    print(added, elapsed, common.rss_mib())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--lines", type=int, default=1000000)
+    parser.add_argument("--measure", nargs=2, metavar=("FILE", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.measure:
+        measure(*args.measure)
+        return
+    
+    file_path = common.TEMP_DIR / "products.txt"
+    generate(file_path, args.lines)
+    print(f"Файл: {args.lines} строк, {file_path.stat().st_size / 1024 / 1024:.0f} MiB")
+    print(f"Пачка: {config.UPLOAD_CHUNK_SIZE}")
+    
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, "--measure", str(file_path), mode],
+            check=True, capture_output=True, text=True
+        ).stdout.split()
+        added, elapsed, rss = int(output[0]), float(output[1]), float(output[2])
+        print(f"{mode:3}  загружено={added:8}  {elapsed:6.1f} s  {added / elapsed:7.0f} строк/с  RSS {rss:6.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()
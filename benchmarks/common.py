@@ -0,0 +1,25 @@
+"""
+Общая подготовка бенчмарков: временная БД вместо рабочей
+Импортировать до database - движок создается при импорте
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import config
+
+TEMP_DIR = Path(tempfile.mkdtemp(prefix="botlogi-bench-"))
+config.DATABASE_PATH = str(TEMP_DIR / "bench.db")
+config.UPLOADS_DIR = TEMP_DIR / "uploads"
+config.BLOBS_DIR = config.UPLOADS_DIR / "blobs"
+config.UPLOADS_DIR.mkdir()
+
+
+def rss_mib() -> float:
+    """Пиковый RSS процесса в МиБ (Linux)"""
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -0,0 +1,130 @@
+"""
+Хранилище файлов товаров по содержимому
+Файл хранится один раз под именем sha256 в подкаталогах BLOBS_DIR/ab/cd/<hash>,
+таблица blobs считает, сколько товаров ссылается на каждый файл
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import config
+
+
+logger = logging.getLogger(__name__)
+
+# Файлы без записи в blobs моложе этого срока не удаляются - их как раз сейчас добавляют
+ORPHAN_GRACE_SECONDS = 600
+
+
+def blob_path(file_hash: str) -> Path:
+    """Путь к файлу в хранилище"""
+    return config.BLOBS_DIR / file_hash[:2] / file_hash[2:4] / file_hash
+
+
+def hash_file(file_path) -> str:
+    """sha256 файла (читается кусками по 1 МБ)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def put_file(db: Session, file_path, move: bool = True) -> str:
+    """
+    Положить файл в хранилище и увеличить счетчик ссылок (без commit)
+    Если такой файл уже есть, исходный удаляется (move=True) и второй копии не появляется
+    Возвращает хэш файла
+    """
+    file_hash = hash_file(file_path)
+    destination = blob_path(file_hash)
+    if destination.exists():
+        if move:
+            os.remove(file_path)
+    else:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        if move:
+            shutil.move(str(file_path), destination)
+        else:
+            shutil.copyfile(file_path, destination)
+    
+    db.execute(text(
+        "INSERT INTO blobs (hash, size, refcount, created_at) VALUES (:hash, :size, 1, :now) "
+        "ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1"
+    ), {"hash": file_hash, "size": destination.stat().st_size, "now": datetime.now()})
+    return file_hash
+
+
+def release(db: Session, file_hash: str, count: int = 1):
+    """Уменьшить счетчик ссылок (без commit); сам файл удаляет collect_garbage"""
+    db.execute(text(
+        "UPDATE blobs SET refcount = MAX(refcount - :count, 0) WHERE hash = :hash"
+    ), {"hash": file_hash, "count": count})
+
+
+def collect_garbage(db: Session) -> tuple:
+    """
+    Удалить файлы, на которые не ссылается ни один товар (с commit)
+    Счетчики ссылок сначала пересчитываются по таблице products - они источник истины
+    Возвращает: (удалено файлов, освобождено байт)
+    """
+    db.execute(text(
+        "UPDATE blobs SET refcount = "
+        "(SELECT COUNT(*) FROM products WHERE products.file_hash = blobs.hash)"
+    ))
+    unreferenced = db.execute(text("SELECT hash, size FROM blobs WHERE refcount = 0")).fetchall()
+    
+    removed = 0
+    freed = 0
+    for file_hash, size in unreferenced:
+        try:
+            os.remove(blob_path(file_hash))
+        except FileNotFoundError:
+            pass
+        db.execute(text("DELETE FROM blobs WHERE hash = :hash AND refcount = 0"), {"hash": file_hash})
+        removed += 1
+        freed += size or 0
+    db.commit()
+    
+    # Файлы без записи в blobs (например, после сбоя между записью файла и commit)
+    known = {row[0] for row in db.execute(text("SELECT hash FROM blobs"))}
+    if config.BLOBS_DIR.exists():
+        for path in config.BLOBS_DIR.glob("*/*/*"):
+            if path.name in known or time.time() - path.stat().st_mtime < ORPHAN_GRACE_SECONDS:
+                continue
+            freed += path.stat().st_size
+            path.unlink()
+            removed += 1
+    return removed, freed
+
+
+def adopt_legacy_files(db: Session) -> int:
+    """
+    Перенос файловых товаров, загруженных до появления хранилища (с commit)
+    Файл перемещается в хранилище, товар получает file_hash; одинаковые файлы сливаются в один
+    Возвращает количество перенесенных товаров
+    """
+    rows = db.execute(text(
+        "SELECT id, file_path FROM products WHERE file_path IS NOT NULL AND file_hash IS NULL"
+    )).fetchall()
+    adopted = 0
+    for product_id, file_path in rows:
+        if not os.path.exists(file_path):
+            logger.warning(f"Файл товара {product_id} не найден: {file_path}")
+            continue
+        # Старые имена: <item_id>_<timestamp>_<имя файла>
+        parts = os.path.basename(file_path).split('_', 2)
+        file_name = parts[2] if len(parts) == 3 else os.path.basename(file_path)
+        file_hash = put_file(db, file_path)
+        db.execute(text(
+            "UPDATE products SET file_hash = :hash, file_path = :path, file_name = :name WHERE id = :id"
+        ), {"hash": file_hash, "path": str(blob_path(file_hash)), "name": file_name, "id": product_id})
+        db.commit()
+        adopted += 1
+    return adopted
@@ -0,0 +1,246 @@
+"""
+Каталог для пользователей в памяти
+Снимок дерева категорий, подкатегорий и позиций загружается одним запросом на таблицу
+и не меняется после создания - обработчик, получивший снимок, видит согласованный каталог
+целиком, без ленивых подгрузок item.subcategory.category
+После commit любой сессии, которая изменила категории, подкатегории или позиции
+(в том числе stock_count при покупке и загрузке товаров), снимок сбрасывается,
+при следующем обращении строится новый со следующим номером версии и подменяется целиком
+Изменения из других процессов бота и через чистый SQL (text) сессии этого процесса
+не видят - поэтому снимок старше CONFIG_CACHE_TTL секунд перечитывается
+(как кэши настроек и блокировок в utils): новая версия появляется, только если
+каталог изменился; для немедленного сброса - invalidate()
+"""
+
+import time
+from dataclasses import dataclass
+from itertools import chain
+from types import MappingProxyType
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from database import Category, Subcategory, Item, SessionLocal
+import config
+
+
+CATALOG_MODELS = (Category, Subcategory, Item)
+
+
+@dataclass(frozen=True)
+class CategoryNode:
+    id: int
+    name: str
+    description: str
+    photo: str
+    position: int
+    is_visible: bool
+
+
+@dataclass(frozen=True)
+class SubcategoryNode:
+    id: int
+    category_id: int
+    name: str
+    description: str
+    photo: str
+    position: int
+    is_visible: bool
+
+
+@dataclass(frozen=True)
+class ItemNode:
+    id: int
+    category_id: int
+    subcategory_id: int
+    name: str
+    description: str
+    photo: str
+    price: float
+    product_type: str
+    out_of_stock_behavior: str
+    stock_count: int
+    position: int
+    is_visible: bool
+
+
+def _position_key(node):
+    # Как ORDER BY position в SQLite: NULL в начале
+    return (node.position is not None, node.position or 0)
+
+
+class CatalogSnapshot:
+    """
+    Неизменяемый снимок каталога
+    Скрытые категории, подкатегории и позиции тоже есть в словарях по id (доступны по прямой
+    ссылке, как и раньше), в списки для навигации попадают только видимые
+    """
+    
+    def __init__(self, version: int, categories, subcategories, items):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.categories_by_id = MappingProxyType({c.id: c for c in categories})
+        self.subcategories_by_id = MappingProxyType({s.id: s for s in subcategories})
+        self.items_by_id = MappingProxyType({i.id: i for i in items})
+        
+        # Видимые категории в порядке position
+        self.categories = tuple(sorted((c for c in categories if c.is_visible), key=_position_key))
+        
+        # category_id -> видимые подкатегории по названию
+        subcategories_by_category = {}
+        for subcategory in sorted(subcategories, key=lambda s: s.name):
+            if subcategory.is_visible:
+                subcategories_by_category.setdefault(subcategory.category_id, []).append(subcategory)
+        self.subcategories = MappingProxyType({k: tuple(v) for k, v in subcategories_by_category.items()})
+        
+        # category_id -> видимые позиции без подкатегории по названию,
+        # subcategory_id -> видимые позиции по position
+        category_items = {}
+        subcategory_items = {}
+        for item in items:
+            if not item.is_visible:
+                continue
+            if item.subcategory_id is not None:
+                subcategory_items.setdefault(item.subcategory_id, []).append(item)
+            elif item.category_id is not None:
+                category_items.setdefault(item.category_id, []).append(item)
+        self.category_items = MappingProxyType({
+            k: tuple(sorted(v, key=lambda i: i.name)) for k, v in category_items.items()
+        })
+        self.subcategory_items = MappingProxyType({
+            k: tuple(sorted(v, key=_position_key)) for k, v in subcategory_items.items()
+        })
+        
+        # Клавиатуры и тексты, построенные по этому снимку (ключ -> результат);
+        # производные данные - пропадают вместе со снимком
+        self.rendered = {}
+    
+    def same_catalog(self, other: "CatalogSnapshot") -> bool:
+        """Те же категории, подкатегории и позиции (версия и клавиатуры не сравниваются)"""
+        return (
+            self.categories_by_id == other.categories_by_id
+            and self.subcategories_by_id == other.subcategories_by_id
+            and self.items_by_id == other.items_by_id
+        )
+    
+    def get_category(self, category_id: int) -> CategoryNode:
+        return self.categories_by_id.get(category_id)
+    
+    def get_subcategory(self, subcategory_id: int) -> SubcategoryNode:
+        return self.subcategories_by_id.get(subcategory_id)
+    
+    def get_item(self, item_id: int) -> ItemNode:
+        return self.items_by_id.get(item_id)
+    
+    def get_subcategory_category_id(self, subcategory_id: int) -> int:
+        """Категория подкатегории (для кнопки "Назад")"""
+        subcategory = self.subcategories_by_id.get(subcategory_id)
+        return subcategory.category_id if subcategory else None
+    
+    def get_item_parents(self, item: ItemNode) -> tuple:
+        """(категория, подкатегория) позиции; для позиции в подкатегории категория берется у нее"""
+        subcategory = self.subcategories_by_id.get(item.subcategory_id)
+        if subcategory:
+            return self.categories_by_id.get(subcategory.category_id), subcategory
+        return self.categories_by_id.get(item.category_id), None
+    
+    def get_item_category_path(self, item: ItemNode) -> str:
+        """"Категория -> Подкатегория" позиции или None, если позиция вне каталога"""
+        category, subcategory = self.get_item_parents(item)
+        if subcategory:
+            return f"{category.name} -> {subcategory.name}" if category else subcategory.name
+        return category.name if category else None
+
+
+_snapshot = None
+_version = 0
+stats = {"hits": 0, "misses": 0}
+
+
+def load_snapshot(db: Session, version: int) -> CatalogSnapshot:
+    """Загрузить каталог из БД: по одному запросу на таблицу"""
+    categories = [
+        CategoryNode(**row._mapping) for row in db.execute(select(
+            Category.id, Category.name, Category.description, Category.photo,
+            Category.position, Category.is_visible
+        ).order_by(Category.id))
+    ]
+    subcategories = [
+        SubcategoryNode(**row._mapping) for row in db.execute(select(
+            Subcategory.id, Subcategory.category_id, Subcategory.name, Subcategory.description,
+            Subcategory.photo, Subcategory.position, Subcategory.is_visible
+        ).order_by(Subcategory.id))
+    ]
+    items = [
+        ItemNode(**row._mapping) for row in db.execute(select(
+            Item.id, Item.category_id, Item.subcategory_id, Item.name, Item.description,
+            Item.photo, Item.price, Item.product_type, Item.out_of_stock_behavior,
+            Item.stock_count, Item.position, Item.is_visible
+        ).order_by(Item.id))
+    ]
+    return CatalogSnapshot(version, categories, subcategories, items)
+
+
+def get_snapshot(db: Session) -> CatalogSnapshot:
+    """
+    Текущий снимок каталога (строится при первом обращении после сброса
+    и перечитывается, когда текущий старше CONFIG_CACHE_TTL секунд)
+    Новый снимок собирается полностью и только потом подменяет старый
+    """
+    global _snapshot, _version
+    snapshot = _snapshot
+    if snapshot is None or time.monotonic() - snapshot.loaded_at > config.CONFIG_CACHE_TTL:
+        fresh = load_snapshot(db, _version + 1)
+        if snapshot is not None and fresh.same_catalog(snapshot):
+            # Перечитан по TTL без изменений - версия и построенные клавиатуры остаются
+            snapshot.loaded_at = fresh.loaded_at
+        else:
+            _version += 1
+            snapshot = _snapshot = fresh
+    return snapshot
+
+
+def get_rendered(db: Session, key: tuple, build):
+    """Клавиатура или текст из кэша снимка; при промахе строится build(snapshot)"""
+    snapshot = get_snapshot(db)
+    rendered = snapshot.rendered.get(key)
+    if rendered is None:
+        stats["misses"] += 1
+        rendered = snapshot.rendered[key] = build(snapshot)
+    else:
+        stats["hits"] += 1
+    return rendered
+
+
+def invalidate():
+    """Сбросить снимок каталога"""
+    global _snapshot
+    _snapshot = None
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def _track_flush(session, flush_context, instances):
+    """Отметить сессию, если в ней создаются, меняются или удаляются объекты каталога"""
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, CATALOG_MODELS):
+            session.info["catalog_changed"] = True
+            return
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _track_bulk(orm_execute_state):
+    """Отметить сессию при массовых UPDATE/DELETE по таблицам каталога (например, stock_count)"""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, CATALOG_MODELS):
+        orm_execute_state.session.info["catalog_changed"] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("catalog_changed", False):
+        invalidate()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _forget_on_rollback(session):
+    session.info.pop("catalog_changed", None)
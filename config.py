@@ -21,10 +21,68 @@ CRYPTOBOT_TOKEN = ""  # Токен CryptoBot (опционально, можно
 # Или через переменную окружения:
 # CRYPTOBOT_TOKEN = os.getenv("CRYPTOBOT_TOKEN", "")
 CRYPTOBOT_API_URL = "https://pay.crypt.bot/api"
+CRYPTOBOT_TIMEOUT = 15  # Общий таймаут запроса к API (секунды)
+CRYPTOBOT_CONNECT_TIMEOUT = 5  # Таймаут установки соединения (секунды)
+CRYPTOBOT_POOL_SIZE = 10  # Максимум одновременных соединений к API
+CRYPTOBOT_KEEPALIVE_TIMEOUT = 60  # Сколько держать неактивное соединение открытым (секунды)
+CRYPTOBOT_BATCH_SIZE = 100  # Сколько инвойсов запрашивать за один вызов getInvoices (не больше 1000)
+PAYMENTS_CHECK_INTERVAL = 30  # Интервал фоновой проверки платежей (секунды)
+PAYMENT_TTL_MINUTES = 15  # Срок жизни инвойса на пополнение (минуты)
+PAYMENT_EXPIRE_GRACE_MINUTES = 5  # Запас после срока жизни, после которого неоплаченный платеж закрывается
+
+# Вебхук CryptoBot (Crypto Pay -> Webhooks): https://ВАШ_ДОМЕН/cryptobot/webhook
+# При включенном вебхуке фоновая проверка платежей остается как резервная сверка,
+# ее интервал (PAYMENTS_CHECK_INTERVAL) можно увеличить
+CRYPTOBOT_WEBHOOK_ENABLED = False
+CRYPTOBOT_WEBHOOK_PATH = "/cryptobot/webhook"
+
+# Режим получения обновлений Telegram: "polling" (long polling) или "webhook"
+# В режиме webhook несколько процессов бота можно поставить за reverse proxy,
+# если состояния диалогов хранятся в Redis (FSM_REDIS_URL): proxy не знает чат
+# обновления, и следующий шаг диалога может попасть в другой процесс.
+# Без FSM_REDIS_URL состояния живут в памяти процесса - только один процесс
+BOT_RUN_MODE = "polling"
+WEBHOOK_BASE_URL = ""  # Внешний адрес за reverse proxy, например "https://bot.example.com"
+TELEGRAM_WEBHOOK_PATH = "/telegram/webhook"
+TELEGRAM_WEBHOOK_SECRET = ""  # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (A-Z, a-z, 0-9, _ и -)
+FSM_REDIS_URL = ""  # Общее хранилище состояний диалогов, например "redis://localhost:6379/0" (нужен pip install redis)
+
+# HTTP-сервер для вебхуков (Telegram и CryptoBot)
+WEBAPP_HOST = "0.0.0.0"
+WEBAPP_PORT = 8080
+
+# Уведомления админам: отправляются фоновой очередью, накопившиеся склеиваются в одно сообщение
+NOTIFY_BATCH_DELAY = 1.0  # Сколько ждать новых уведомлений перед отправкой пачки (секунды)
+NOTIFY_MAX_BATCH = 20  # Максимум уведомлений в одном сообщении
+NOTIFY_SEND_INTERVAL = 0.05  # Пауза между сообщениями разным админам (секунды)
+# Сводки: если уведомлений одного типа больше NOTIFY_DIGEST_THRESHOLD за NOTIFY_DIGEST_WINDOW секунд,
+# следующие события копятся и отправляются одной сводкой раз в NOTIFY_DIGEST_INTERVAL секунд
+# (включается для каждого типа в админке: Уведомления -> Сводки)
+NOTIFY_DIGEST_THRESHOLD = 10
+NOTIFY_DIGEST_WINDOW = 60
+NOTIFY_DIGEST_INTERVAL = 60
+NOTIFY_DIGEST_TOP_ITEMS = 5  # Сколько позиций показывать в сводке покупок
+
+# Рассылки
+BROADCAST_RATE = 25  # Сообщений в секунду на все рассылки (лимит Telegram - около 30)
+BROADCAST_BURST = 5  # Сколько сообщений можно отправить разом сверх средней скорости
+BROADCAST_CONCURRENCY = 10  # Одновременных запросов к Telegram
+BROADCAST_CHUNK_SIZE = 200  # Получателей за один запрос к БД; после каждой порции прогресс сохраняется
+BROADCAST_PROGRESS_INTERVAL = 5  # Как часто обновлять сообщение с прогрессом (секунды)
+BROADCAST_MAX_RETRIES = 3  # Попыток отправки одному получателю после RetryAfter
+BROADCAST_CLAIM_TIMEOUT = 120  # Через сколько секунд без сохранения прогресса рассылку может забрать другой процесс
+
+# Загрузка строковых товаров из .txt
+UPLOAD_CHUNK_SIZE = 10000  # Строк на одну транзакцию
+UPLOAD_PROGRESS_INTERVAL = 3  # Как часто обновлять прогресс загрузки (секунды)
 
 # База данных
 DATABASE_PATH = "bot_database.db"
 
+# Время жизни кэша настроек и ответов бота в памяти (секунды)
+# Изменения из админки применяются сразу, TTL нужен, если БД меняют извне
+CONFIG_CACHE_TTL = 60
+
 # Канал для подписки
 REQUIRED_CHANNEL_ID = os.getenv("REQUIRED_CHANNEL_ID", None)  # None если не требуется
 
@@ -32,6 +90,7 @@ REQUIRED_CHANNEL_ID = os.getenv("REQUIRED_CHANNEL_ID", None)  # None если н
 BASE_DIR = Path(__file__).parent
 UPLOADS_DIR = BASE_DIR / "uploads"
 LOGS_DIR = BASE_DIR / "logs"
+BLOBS_DIR = UPLOADS_DIR / "blobs"  # Файлы товаров по содержимому (подкаталоги создаются автоматически)
 
 # Создаем директории
 UPLOADS_DIR.mkdir(exist_ok=True)
@@ -124,5 +183,8 @@ DEFAULT_SETTINGS = {
     "notify_new_purchase": True,
     "notify_new_payment": True,
     "notify_out_of_stock": True,
+    "notify_new_purchase_digest": True,
+    "notify_new_payment_digest": True,
+    "notify_out_of_stock_digest": True,
 }
 
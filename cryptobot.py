@@ -0,0 +1,87 @@
+"""
+Клиент CryptoBot (Crypto Pay API)
+Одна долгоживущая aiohttp-сессия с пулом соединений на весь процесс
+"""
+
+import logging
+import aiohttp
+import config
+
+
+logger = logging.getLogger(__name__)
+
+# Максимум инвойсов в одном ответе getInvoices (параметр count)
+MAX_INVOICES_PER_REQUEST = 1000
+
+
+class CryptoBotClient:
+    """Клиент Crypto Pay API с общим пулом keep-alive соединений"""
+    
+    def __init__(self):
+        self._session = None
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Сессия создается лениво - внутри работающего event loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=config.CRYPTOBOT_POOL_SIZE,
+                keepalive_timeout=config.CRYPTOBOT_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=config.CRYPTOBOT_TIMEOUT,
+                connect=config.CRYPTOBOT_CONNECT_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+    
+    async def request(self, api_method: str, http_method: str = "GET", params: dict = None, data: dict = None):
+        """
+        Вызов метода API
+        Возвращает поле result ответа или None, если API вернул ошибку
+        """
+        if not config.CRYPTOBOT_TOKEN:
+            return None
+        
+        url = f"{config.CRYPTOBOT_API_URL}/{api_method}"
+        # Токен берется при каждом запросе - его можно сменить из админки без перезапуска
+        headers = {
+            "Crypto-Pay-API-Token": config.CRYPTOBOT_TOKEN
+        }
+        
+        session = self._get_session()
+        async with session.request(http_method, url, headers=headers, params=params, json=data) as response:
+            result = await response.json()
+        
+        if result.get("ok"):
+            return result.get("result")
+        logger.warning(f"CryptoBot {api_method}: {result.get('error')}")
+        return None
+    
+    async def create_invoice(self, data: dict):
+        """Создание инвойса"""
+        return await self.request("createInvoice", "POST", data=data)
+    
+    async def get_invoices(self, invoice_ids: list) -> list:
+        """
+        Инвойсы по списку ID (не больше MAX_INVOICES_PER_REQUEST)
+        count передается явно - без него API отдает не больше 100 инвойсов
+        Возвращает None, если API вернул ошибку - это не то же самое, что "инвойсов нет"
+        """
+        result = await self.request("getInvoices", params={
+            "invoice_ids": ",".join(str(invoice_id) for invoice_id in invoice_ids),
+            "count": len(invoice_ids)
+        })
+        if result is None:
+            return None
+        return result.get("items", [])
+    
+    async def close(self):
+        """Закрыть сессию и пул соединений (при остановке бота)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# Общий клиент для всего процесса
+client = CryptoBotClient()
@@ -3,11 +3,12 @@
 SQLite с использованием SQLAlchemy
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, Text, ForeignKey, JSON
+from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, Text, ForeignKey, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy import text
 from datetime import datetime
+import hashlib
 import json
 
 Base = declarative_base()
@@ -32,6 +33,8 @@ class User(Base):
     block_type = Column(String(20), default='normal')  # 'normal' или 'silent'
     block_reason = Column(Text)  # Причина блокировки
     is_subscribed = Column(Boolean, default=False)  # Подписан ли на канал
+    is_reachable = Column(Boolean, default=True)  # False - бот заблокирован пользователем или аккаунт удален
+    unreachable_since = Column(DateTime)  # Когда сообщение пользователю впервые не дошло
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     
@@ -86,6 +89,7 @@ class Item(Base):
     is_visible = Column(Boolean, default=True)
     product_type = Column(String(20), nullable=False)  # 'string' или 'file'
     out_of_stock_behavior = Column(String(50), default='show_no_stock')  # 'show_no_stock', 'hide', 'show_no_button'
+    stock_count = Column(Integer, default=0, nullable=False)  # Счетчик непроданных товаров (products.is_sold = 0)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     
@@ -95,14 +99,30 @@ class Item(Base):
     purchases = relationship("Purchase", back_populates="item")
 
 
+def content_hash(content: str) -> str:
+    """Хэш строки товара для поиска дубликатов (blake2b, 16 байт, hex)"""
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
 class Product(Base):
     """Товар (строка или файл)"""
     __tablename__ = 'products'
+    __table_args__ = (
+        # Наличие и выборка непроданных товаров позиции
+        Index('ix_products_item_id_is_sold', 'item_id', 'is_sold'),
+        # Дубликаты строк внутри позиции (NULL - без проверки на дубликаты)
+        Index('ux_products_item_id_content_hash', 'item_id', 'content_hash', unique=True),
+        # Товары, ссылающиеся на файл хранилища
+        Index('ix_products_file_hash', 'file_hash'),
+    )
     
     id = Column(Integer, primary_key=True)
     item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
     content = Column(Text)  # Для строковых товаров - содержимое строки
+    content_hash = Column(String(32))  # content_hash(content) для строковых товаров
     file_path = Column(String(500))  # Для файловых товаров - путь к файлу
+    file_hash = Column(String(64))  # Для файловых товаров - sha256 файла в хранилище (blobstore)
+    file_name = Column(String(255))  # Имя файла, с которым его получит покупатель
     file_id = Column(String(500))  # Telegram file_id
     is_sold = Column(Boolean, default=False)
     sold_at = Column(DateTime)
@@ -115,6 +135,10 @@ class Product(Base):
 class Purchase(Base):
     """Покупка"""
     __tablename__ = 'purchases'
+    __table_args__ = (
+        # История покупок пользователя (ORDER BY created_at DESC)
+        Index('ix_purchases_user_id_created_at', 'user_id', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -127,17 +151,46 @@ class Purchase(Base):
     user = relationship("User", back_populates="purchases")
     item = relationship("Item", back_populates="purchases")
     product = relationship("Product", back_populates="purchases")
+    products = relationship("Product", secondary="purchase_products", order_by="Product.id", viewonly=True)
+
+
+class Blob(Base):
+    """Файл в хранилище по содержимому (blobstore)"""
+    __tablename__ = 'blobs'
+    
+    id = Column(Integer, primary_key=True)
+    hash = Column(String(64), unique=True, nullable=False)  # sha256 содержимого
+    size = Column(Integer)
+    refcount = Column(Integer, default=0, nullable=False)  # Сколько товаров ссылается на файл
+    created_at = Column(DateTime, default=datetime.now)
+
+
+class PurchaseProduct(Base):
+    """Товары, выданные в покупке (для повторной выдачи из истории)"""
+    __tablename__ = 'purchase_products'
+    __table_args__ = (
+        # Повторная выдача: все товары покупки одним запросом по индексу
+        Index('ix_purchase_products_purchase_id', 'purchase_id'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    purchase_id = Column(Integer, ForeignKey('purchases.id'), nullable=False)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
 
 
 class Payment(Base):
     """Платеж"""
     __tablename__ = 'payments'
+    __table_args__ = (
+        # Проверка ожидающих платежей
+        Index('ix_payments_status_created_at', 'status', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     amount = Column(Float, nullable=False)
     cryptobot_invoice_id = Column(String(255))
-    status = Column(String(50), default='pending')  # pending, paid, failed
+    status = Column(String(50), default='pending')  # pending, paid, expired, failed
     created_at = Column(DateTime, default=datetime.now)
     paid_at = Column(DateTime)
 
@@ -198,6 +251,9 @@ class BotResponse(Base):
 class Log(Base):
     """Лог действий"""
     __tablename__ = 'logs'
+    __table_args__ = (
+        Index('ix_logs_log_type_created_at', 'log_type', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     log_type = Column(String(100), nullable=False)  # purchase, payment, promocode_create, etc.
@@ -217,8 +273,37 @@ class Setting(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
+class BroadcastJob(Base):
+    """Рассылка: прогресс сохраняется по мере отправки, после перезапуска продолжается"""
+    __tablename__ = 'broadcast_jobs'
+    __table_args__ = (
+        # Незавершенные рассылки при запуске бота
+        Index('ix_broadcast_jobs_status', 'status'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    admin_id = Column(Integer, nullable=False)  # Telegram ID админа
+    text = Column(Text)
+    photo_id = Column(String(500))
+    recipients = Column(String(20), nullable=False)  # all, buyers, non_buyers
+    status = Column(String(20), default='running')  # running, done, cancelled
+    last_user_id = Column(Integer, default=0, nullable=False)  # users.id последнего обработанного получателя
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    progress_chat_id = Column(Integer)
+    progress_message_id = Column(Integer)
+    owner = Column(String(64))  # Процесс бота, который отправляет рассылку
+    heartbeat_at = Column(DateTime)  # Когда владелец последний раз сохранял прогресс
+    created_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime)
+
+
 def init_db():
     """Инициализация базы данных"""
+    from sqlalchemy import inspect
+    
+    has_purchase_products = inspect(engine).has_table('purchase_products')
     Base.metadata.create_all(engine)
     
     # Миграции
@@ -249,6 +334,27 @@ def init_db():
             db.execute(sql_text("ALTER TABLE users ADD COLUMN is_subscribed BOOLEAN DEFAULT 0"))
             db.commit()
             print("Миграция: добавлена колонка is_subscribed в users")
+        if 'is_reachable' not in columns:
+            db.execute(sql_text("ALTER TABLE users ADD COLUMN is_reachable BOOLEAN DEFAULT 1"))
+            db.execute(sql_text("ALTER TABLE users ADD COLUMN unreachable_since DATETIME"))
+            db.commit()
+            print("Миграция: добавлены колонки is_reachable и unreachable_since в users")
+        
+        # Миграция: хэши строковых товаров для поиска дубликатов
+        result = db.execute(sql_text("PRAGMA table_info(products)"))
+        columns = [row[1] for row in result]
+        if 'content_hash' not in columns:
+            db.execute(sql_text("ALTER TABLE products ADD COLUMN content_hash VARCHAR(32)"))
+            db.commit()
+            hashed = backfill_content_hashes(db)
+            print(f"Миграция: добавлена колонка content_hash в products, уникальных строк: {hashed}")
+        if 'file_hash' not in columns:
+            db.execute(sql_text("ALTER TABLE products ADD COLUMN file_hash VARCHAR(64)"))
+            db.execute(sql_text("ALTER TABLE products ADD COLUMN file_name VARCHAR(255)"))
+            db.commit()
+            import blobstore
+            adopted = blobstore.adopt_legacy_files(db)
+            print(f"Миграция: файловые товары перенесены в хранилище по содержимому: {adopted}")
         
         # Миграция: добавляем колонку category_id в items если её нет
         result = db.execute(sql_text("PRAGMA table_info(items)"))
@@ -257,12 +363,38 @@ def init_db():
             db.execute(sql_text("ALTER TABLE items ADD COLUMN category_id INTEGER REFERENCES categories(id)"))
             db.commit()
             print("Миграция: добавлена колонка category_id в items")
+        if 'stock_count' not in columns:
+            db.execute(sql_text("ALTER TABLE items ADD COLUMN stock_count INTEGER NOT NULL DEFAULT 0"))
+            db.commit()
+            rebuild_item_stock(db)
+            print("Миграция: добавлена колонка stock_count в items")
+        
+        # Миграция: владелец рассылки - при нескольких процессах рассылку продолжает один
+        result = db.execute(sql_text("PRAGMA table_info(broadcast_jobs)"))
+        columns = [row[1] for row in result]
+        if 'owner' not in columns:
+            db.execute(sql_text("ALTER TABLE broadcast_jobs ADD COLUMN owner VARCHAR(64)"))
+            db.execute(sql_text("ALTER TABLE broadcast_jobs ADD COLUMN heartbeat_at DATETIME"))
+            db.commit()
+            print("Миграция: добавлены колонки owner и heartbeat_at в broadcast_jobs")
+        
+        # Миграция: связи покупок с выданными товарами для покупок, сделанных до появления таблицы
+        if not has_purchase_products:
+            linked = backfill_purchase_products(db)
+            if linked:
+                print(f"Миграция: заполнена таблица purchase_products, связано товаров: {linked}")
     except Exception as e:
         print(f"Ошибка при миграции: {e}")
         db.rollback()
     finally:
         db.close()
     
+    # Индексы для уже существующих таблиц (create_all создает их только вместе с новой таблицей)
+    # Создаются после миграций - индекс может ссылаться на только что добавленную колонку
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    
     # Создаем дефолтные ответы бота
     db = SessionLocal()
     try:
@@ -310,6 +442,118 @@ def init_db():
         db.close()
 
 
+def rebuild_item_stock(db) -> int:
+    """
+    Пересчет счетчиков наличия (items.stock_count) по таблице products
+    Возвращает количество позиций, у которых счетчик расходился с фактом
+    """
+    actual = "(SELECT COUNT(*) FROM products WHERE products.item_id = items.id AND products.is_sold = 0)"
+    mismatched = db.execute(text(f"SELECT COUNT(*) FROM items WHERE stock_count != {actual}")).scalar()
+    db.execute(text(f"UPDATE items SET stock_count = {actual}"))
+    db.commit()
+    return mismatched
+
+
+def backfill_content_hashes(db, chunk_size: int = 10000) -> int:
+    """
+    Заполнение products.content_hash для строковых товаров
+    Сначала создается уникальный индекс, затем хэши проставляются через UPDATE OR IGNORE:
+    у уже существующих дубликатов (кроме первого) хэш остается NULL
+    Возвращает количество строк, получивших хэш
+    """
+    unique_index = next(
+        index for index in Product.__table__.indexes
+        if index.name == 'ux_products_item_id_content_hash'
+    )
+    unique_index.create(db.get_bind(), checkfirst=True)
+    
+    hashed = 0
+    last_id = 0
+    while True:
+        rows = db.execute(text(
+            "SELECT id, content FROM products WHERE id > :last_id AND content IS NOT NULL "
+            "ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": chunk_size}).fetchall()
+        if not rows:
+            break
+        result = db.execute(
+            text("UPDATE OR IGNORE products SET content_hash = :hash WHERE id = :id"),
+            [{"id": row[0], "hash": content_hash(row[1])} for row in rows]
+        )
+        hashed += result.rowcount
+        db.commit()
+        last_id = rows[-1][0]
+    return hashed
+
+
+def backfill_purchase_products(db) -> int:
+    """
+    Заполнение purchase_products для старых покупок без связей
+    Старая логика покупки записывала в purchases.product_id точный товар: единственный
+    для файловой позиции, первую строку для строковой - с него и начинается каждая покупка
+    Остальные строки покупки (quantity > 1) неизвестны; старая логика помечала их проданными
+    сразу после первой, поэтому берутся ближайшие по времени продажи непривязанные товары
+    позиции, проданные не раньше первой строки
+    Возвращает количество созданных связей
+    """
+    linked = 0
+    item_ids = [row[0] for row in db.execute(text(
+        "SELECT DISTINCT item_id FROM purchases WHERE id NOT IN (SELECT purchase_id FROM purchase_products)"
+    ))]
+    for item_id in item_ids:
+        purchases = db.execute(text(
+            "SELECT id, quantity, product_id FROM purchases "
+            "WHERE item_id = :item_id AND id NOT IN (SELECT purchase_id FROM purchase_products) "
+            "ORDER BY created_at, id"
+        ), {"item_id": item_id}).fetchall()
+        # Непривязанные проданные товары позиции в порядке продажи
+        sold = [tuple(row) for row in db.execute(text(
+            "SELECT id, sold_at FROM products "
+            "WHERE item_id = :item_id AND is_sold = 1 AND id NOT IN (SELECT product_id FROM purchase_products) "
+            "ORDER BY sold_at, id"
+        ), {"item_id": item_id})]
+        sold_at = dict(sold)
+        
+        # Сначала известные товары из purchases.product_id
+        links = []
+        claimed = set()
+        anchors = {}
+        for purchase_id, quantity, product_id in purchases:
+            if product_id in sold_at and product_id not in claimed:
+                claimed.add(product_id)
+                anchors[purchase_id] = product_id
+                links.append({"purchase_id": purchase_id, "product_id": product_id})
+        
+        # Затем остальные строки - по времени продажи
+        remaining = [(when, product_id) for product_id, when in sold if product_id not in claimed]
+        for purchase_id, quantity, product_id in purchases:
+            need = (quantity or 1) - (1 if purchase_id in anchors else 0)
+            if need <= 0 or not remaining:
+                continue
+            start = 0
+            anchor_time = sold_at.get(anchors.get(purchase_id))
+            if anchor_time is not None:
+                start = next(
+                    (i for i, (when, _) in enumerate(remaining) if when is not None and when >= anchor_time),
+                    len(remaining)
+                )
+            taken = remaining[start:start + need]
+            if len(taken) < need:
+                # Не хватило строк после первой - добираем самые ранние из оставшихся
+                taken += remaining[:start][:need - len(taken)]
+            for entry in taken:
+                remaining.remove(entry)
+                links.append({"purchase_id": purchase_id, "product_id": entry[1]})
+        
+        if links:
+            db.execute(text(
+                "INSERT INTO purchase_products (purchase_id, product_id) VALUES (:purchase_id, :product_id)"
+            ), links)
+            linked += len(links)
+    db.commit()
+    return linked
+
+
 def get_db():
     """Получить сессию БД"""
     db = SessionLocal()
@@ -318,3 +562,56 @@ def get_db():
     finally:
         db.close()
 
+
+# Горячие запросы бота для проверки планов выполнения
+HOT_QUERIES = {
+    "products_in_stock": "SELECT id, content FROM products WHERE item_id = 1 AND is_sold = 0 LIMIT 5",
+    "purchase_history": "SELECT id FROM purchases WHERE user_id = 1 ORDER BY created_at DESC",
+    "purchase_products": "SELECT product_id FROM purchase_products WHERE purchase_id = 1",
+    "pending_payments": "SELECT id FROM payments WHERE status = 'pending'",
+    "broadcast_buyers_chunk": (
+        "SELECT id, user_id FROM users WHERE is_blocked = 0 AND is_reachable = 1 AND id > 0 "
+        "AND EXISTS (SELECT 1 FROM purchases WHERE purchases.user_id = users.id) ORDER BY id LIMIT 200"
+    ),
+    "running_broadcasts": "SELECT id FROM broadcast_jobs WHERE status = 'running'",
+    "logs_by_type": "SELECT id FROM logs WHERE log_type = 'purchase' ORDER BY created_at DESC",
+    "user_by_telegram_id": "SELECT id FROM users WHERE user_id = 1",
+    "setting_by_key": "SELECT value FROM settings WHERE key = 'maintenance_mode'",
+    "bot_response_by_key": "SELECT text, photo FROM bot_responses WHERE key = 'start'",
+}
+
+
+def explain_hot_queries(db) -> list:
+    """
+    EXPLAIN QUERY PLAN для горячих запросов
+    Возвращает список (name, plan, uses_index); uses_index=False, если есть полный проход по таблице
+    """
+    results = []
+    for name, query in HOT_QUERIES.items():
+        rows = db.execute(text(f"EXPLAIN QUERY PLAN {query}")).fetchall()
+        plan = [row[-1] for row in rows]
+        uses_index = all(
+            "USING" in detail
+            for detail in plan
+            if detail.startswith("SCAN") or detail.startswith("SEARCH")
+        )
+        results.append((name, plan, uses_index))
+    return results
+
+
+if __name__ == "__main__":
+    # python database.py explain - проверить, что горячие запросы используют индексы
+    import sys
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "explain":
+        init_db()
+        db = SessionLocal()
+        try:
+            failed = False
+            for name, plan, uses_index in explain_hot_queries(db):
+                print(f"{'OK  ' if uses_index else 'SCAN'} {name}: {'; '.join(plan)}")
+                failed = failed or not uses_index
+        finally:
+            db.close()
+        sys.exit(1 if failed else 0)
+    print("Использование: python database.py explain")
@@ -10,17 +10,22 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from database import (
     User, Category, Subcategory, Item, Product, Purchase, Payment,
-    Promocode, PromocodeActivation, Button, BotResponse, Setting, Log, get_db
+    Promocode, PromocodeActivation, Button, BotResponse, Setting, Log, get_db,
+    rebuild_item_stock
 )
 import keyboards as kb
 import utils
+import notifications
+import blobstore
+import catalog
+from services import broadcast
+from services import products as products_service
 import config
 from datetime import datetime
 import json
 import csv
 import io
 import os
-import asyncio
 
 
 router = Router()
@@ -296,6 +301,7 @@ async def save_response_with_photo(message: Message, state: FSMContext):
             db.add(response)
         
         db.commit()
+        utils.invalidate_bot_response(key)
         utils.log_action(db, "admin_action", admin_id=message.from_user.id, data={
             "action": "edit_response",
             "key": key
@@ -326,6 +332,7 @@ async def save_response(message: Message, state: FSMContext):
             db.add(response)
         
         db.commit()
+        utils.invalidate_bot_response(key)
         utils.log_action(db, "admin_action", admin_id=message.from_user.id, data={
             "action": "edit_response",
             "key": key
@@ -615,6 +622,7 @@ async def save_button_action(message: Message, state: FSMContext):
                     )
                     db.add(response)
                     db.commit()
+                    utils.invalidate_bot_response(response.key)
             
             utils.log_action(db, "admin_action", admin_id=message.from_user.id, data={
                 "action": "edit_button_action",
@@ -1524,9 +1532,10 @@ async def upload_item_products(callback: CallbackQuery, state: FSMContext):
         await state.update_data(item_id=item_id)
         
         if item.product_type == 'string':
+            await state.update_data(dedupe=True)
             await callback.message.answer(
-                f"Отправьте .txt файл с логами для позиции '{item.name}'.\n"
-                "Каждая строка файла будет одним товаром."
+                get_upload_prompt(item.name, True),
+                reply_markup=get_dedupe_keyboard(True)
             )
         else:
             await callback.message.answer(
@@ -1537,6 +1546,53 @@ async def upload_item_products(callback: CallbackQuery, state: FSMContext):
         db.close()
 
 
+def get_upload_prompt(item_name: str, dedupe: bool) -> str:
+    """Текст приглашения к загрузке строковых товаров"""
+    text = (
+        f"Отправьте .txt файл с логами для позиции '{item_name}'.\n"
+        "Каждая строка файла будет одним товаром."
+    )
+    if dedupe:
+        text += "\n\n🔁 Строки, которые уже есть у позиции (в том числе проданные), будут пропущены."
+    return text
+
+
+def get_dedupe_keyboard(dedupe: bool) -> InlineKeyboardMarkup:
+    """Переключатель режима пропуска дубликатов"""
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(
+        text=f"{'✅' if dedupe else '❌'} Пропускать дубликаты",
+        callback_data="admin_upload_dedupe_toggle"
+    ))
+    return builder.as_markup()
+
+
+@router.callback_query(AdminStates.uploading_products, F.data == "admin_upload_dedupe_toggle")
+async def toggle_upload_dedupe(callback: CallbackQuery, state: FSMContext):
+    """Включить/выключить пропуск дубликатов при загрузке"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Доступ запрещен")
+        return
+    
+    data = await state.get_data()
+    dedupe = not data.get("dedupe", True)
+    await state.update_data(dedupe=dedupe)
+    
+    db = next(get_db())
+    try:
+        item = db.query(Item).filter(Item.id == data.get("item_id")).first()
+        if not item:
+            await callback.answer("Позиция не найдена")
+            return
+        await callback.message.edit_text(
+            get_upload_prompt(item.name, dedupe),
+            reply_markup=get_dedupe_keyboard(dedupe)
+        )
+        await callback.answer(f"Пропуск дубликатов {'включен' if dedupe else 'выключен'}")
+    finally:
+        db.close()
+
+
 @router.message(AdminStates.uploading_products, F.document)
 async def process_uploaded_file(message: Message, state: FSMContext):
     """Обработка загруженного файла"""
@@ -1567,41 +1623,46 @@ async def process_uploaded_file(message: Message, state: FSMContext):
             file_path = config.UPLOADS_DIR / f"{item_id}_{datetime.now().timestamp()}.txt"
             await message.bot.download_file(file.file_path, file_path)
             
-            # Читаем и создаем товары
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
+            # Потоковая загрузка пачками с прогрессом в одном сообщении
+            progress = await message.answer("⏳ Загрузка товаров...")
             
-            count = 0
-            for line in lines:
-                line = line.strip()
-                if line:
-                    product = Product(
-                        item_id=item_id,
-                        content=line
-                    )
-                    db.add(product)
-                    count += 1
+            async def show_progress(loaded: int, fraction: float):
+                try:
+                    await progress.edit_text(f"⏳ Загружено {loaded} товаров ({fraction:.0%})")
+                except Exception:
+                    pass
             
-            db.commit()
+            dedupe = data.get("dedupe", True)
+            count, duplicates = await products_service.import_product_lines(
+                db, item_id, file_path, on_progress=show_progress, dedupe=dedupe
+            )
             
             utils.log_action(db, "admin_action", admin_id=message.from_user.id, data={
                 "action": "upload_products",
                 "item_id": item_id,
-                "count": count
+                "count": count,
+                "duplicates": duplicates
             })
             
-            await message.answer(f"✅ Загружено {count} товаров!")
+            result_text = f"✅ Загружено {count} товаров!"
+            if dedupe:
+                result_text += f"\n🔁 Пропущено дубликатов: {duplicates}"
+            await progress.edit_text(result_text)
         else:
-            # Для файловых товаров - сохраняем файл
-            file_path = config.UPLOADS_DIR / f"{item_id}_{datetime.now().timestamp()}_{message.document.file_name}"
-            await message.bot.download_file(file.file_path, file_path)
+            # Для файловых товаров - файл в хранилище по содержимому, одинаковые файлы хранятся один раз
+            temp_path = config.UPLOADS_DIR / f"{item_id}_{datetime.now().timestamp()}.part"
+            await message.bot.download_file(file.file_path, temp_path)
+            file_hash = blobstore.put_file(db, temp_path)
             
             product = Product(
                 item_id=item_id,
-                file_path=str(file_path),
+                file_path=str(blobstore.blob_path(file_hash)),
+                file_hash=file_hash,
+                file_name=message.document.file_name,
                 file_id=message.document.file_id
             )
             db.add(product)
+            utils.change_item_stock(db, item_id, 1)
             db.commit()
             
             utils.log_action(db, "admin_action", admin_id=message.from_user.id, data={
@@ -1616,6 +1677,53 @@ async def process_uploaded_file(message: Message, state: FSMContext):
         db.close()
 
 
+@router.message(Command("recount_stock"))
+async def recount_stock(message: Message):
+    """Пересчет счетчиков наличия по таблице товаров"""
+    if not is_admin(message.from_user.id):
+        await message.answer(config.TEXTS["admin_only"])
+        return
+    
+    db = next(get_db())
+    try:
+        mismatched = rebuild_item_stock(db)
+        # Пересчет идет чистым SQL - кэш каталога сам не сбросится
+        catalog.invalidate()
+        
+        utils.log_action(db, "admin_action", admin_id=message.from_user.id, data={
+            "action": "recount_stock",
+            "mismatched": mismatched
+        })
+        
+        await message.answer(f"✅ Счетчики наличия пересчитаны\nИсправлено позиций: {mismatched}")
+    finally:
+        db.close()
+
+
+@router.message(Command("gc_blobs"))
+async def gc_blobs(message: Message):
+    """Удаление файлов товаров, на которые больше не ссылается ни один товар"""
+    if not is_admin(message.from_user.id):
+        await message.answer(config.TEXTS["admin_only"])
+        return
+    
+    db = next(get_db())
+    try:
+        removed, freed = blobstore.collect_garbage(db)
+        
+        utils.log_action(db, "admin_action", admin_id=message.from_user.id, data={
+            "action": "gc_blobs",
+            "removed": removed,
+            "freed": freed
+        })
+        
+        await message.answer(
+            f"✅ Хранилище файлов очищено\nУдалено файлов: {removed}\nОсвобождено: {freed / 1024 / 1024:.2f} МБ"
+        )
+    finally:
+        db.close()
+
+
 # ========== ПЛАТЕЖКА ==========
 
 @router.callback_query(F.data == "admin_payments")
@@ -1863,6 +1971,7 @@ async def toggle_user_block(callback: CallbackQuery, state: FSMContext):
                 user.block_type = None
                 user.block_reason = None
                 db.commit()
+                utils.set_user_unblocked(user.user_id)
                 
                 utils.log_action(db, "admin_action", admin_id=callback.from_user.id, data={
                     "action": "unblock_user",
@@ -1913,6 +2022,7 @@ async def set_block_type(callback: CallbackQuery, state: FSMContext):
                 user.block_type = 'silent'
                 user.block_reason = None
                 db.commit()
+                utils.set_user_blocked(user.user_id, 'silent')
                 
                 utils.log_action(db, "admin_action", admin_id=callback.from_user.id, data={
                     "action": "block_user",
@@ -1952,6 +2062,7 @@ async def save_block_reason(message: Message, state: FSMContext):
             user.block_type = block_type
             user.block_reason = block_reason
             db.commit()
+            utils.set_user_blocked(user.user_id, block_type, block_reason)
             
             utils.log_action(db, "admin_action", admin_id=message.from_user.id, data={
                 "action": "block_user",
@@ -2184,46 +2295,48 @@ async def process_broadcast(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     text = data.get("broadcast_text", "")
     photo_id = data.get("broadcast_photo")
+    recipients = callback.data.replace("broadcast_", "", 1)
+    if recipients not in broadcast.RECIPIENTS_TITLES:
+        await callback.answer("Неизвестный фильтр получателей")
+        return
     
     db = next(get_db())
     try:
-        if callback.data == "broadcast_all":
-            users = db.query(User).filter(User.is_blocked == False).all()
-        elif callback.data == "broadcast_buyers":
-            users = db.query(User).join(Purchase).filter(User.is_blocked == False).distinct().all()
-        else:  # broadcast_non_buyers
-            buyers_ids = db.query(Purchase.user_id).distinct().subquery()
-            users = db.query(User).filter(
-                User.is_blocked == False,
-                ~User.id.in_(db.query(buyers_ids))
-            ).all()
-        
-        await callback.message.answer(f"Начинаю рассылку для {len(users)} пользователей...")
-        
-        success = 0
-        failed = 0
-        
-        for user in users:
-            try:
-                if photo_id:
-                    await callback.bot.send_photo(user.user_id, photo_id, caption=text)
-                else:
-                    await callback.bot.send_message(user.user_id, text)
-                success += 1
-            except:
-                failed += 1
-            await asyncio.sleep(0.05)  # Задержка между сообщениями
-        
-        utils.log_action(db, "admin_action", admin_id=callback.from_user.id, data={
-            "action": "broadcast",
-            "filter": callback.data,
-            "success": success,
-            "failed": failed
-        })
+        # Рассылка идет в фоне, прогресс обновляется в этом сообщении
+        job = broadcast.create_job(db, callback.from_user.id, text, photo_id, recipients)
+        progress = await callback.message.answer(
+            broadcast.format_progress(job),
+            reply_markup=broadcast.get_progress_keyboard(job)
+        )
+        job.progress_chat_id = progress.chat.id
+        job.progress_message_id = progress.message_id
+        db.commit()
         
-        await callback.message.answer(f"✅ Рассылка завершена!\nУспешно: {success}\nОшибок: {failed}")
+        broadcast.start_job(callback.bot, job.id)
         await state.clear()
-        await callback.answer()
+        await callback.answer("Рассылка запущена")
+    finally:
+        db.close()
+
+
+@router.callback_query(F.data.startswith("bcjob_stop_"))
+async def stop_broadcast(callback: CallbackQuery):
+    """Остановка рассылки"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Доступ запрещен")
+        return
+    
+    job_id = int(callback.data.split("_")[2])
+    db = next(get_db())
+    try:
+        if broadcast.cancel_job(db, job_id):
+            utils.log_action(db, "admin_action", admin_id=callback.from_user.id, data={
+                "action": "broadcast_cancel",
+                "broadcast_id": job_id
+            })
+            await callback.answer("⛔ Рассылка будет остановлена после текущей порции")
+        else:
+            await callback.answer("Рассылка уже завершена")
     finally:
         db.close()
 
@@ -3048,10 +3161,13 @@ async def execute_delete_category(callback: CallbackQuery):
         category_name = category.name
         
         # Удаляем связанные подкатегории и позиции
-        subcategories = db.query(Subcategory).filter(Subcategory.category_id == category_id).all()
-        for subcat in subcategories:
-            # Удаляем позиции подкатегории
-            db.query(Item).filter(Item.subcategory_id == subcat.id).delete()
+        subcategory_ids = db.query(Subcategory.id).filter(Subcategory.category_id == category_id)
+        item_ids = [row[0] for row in db.query(Item.id).filter(
+            Item.subcategory_id.in_(subcategory_ids.scalar_subquery())
+        )]
+        # Покупки, товары и их связи, файлы товаров - как при удалении позиции
+        products_service.delete_items_contents(db, item_ids)
+        db.query(Item).filter(Item.id.in_(item_ids)).delete(synchronize_session=False)
         
         # Удаляем подкатегории
         db.query(Subcategory).filter(Subcategory.category_id == category_id).delete()
@@ -3157,8 +3273,10 @@ async def execute_delete_subcategory(callback: CallbackQuery):
         
         subcat_name = subcat.name
         
-        # Удаляем позиции
-        db.query(Item).filter(Item.subcategory_id == subcat_id).delete()
+        # Удаляем позиции вместе с покупками, товарами и их связями, освобождаем файлы
+        item_ids = [row[0] for row in db.query(Item.id).filter(Item.subcategory_id == subcat_id)]
+        products_service.delete_items_contents(db, item_ids)
+        db.query(Item).filter(Item.id.in_(item_ids)).delete(synchronize_session=False)
         
         # Удаляем подкатегорию
         db.delete(subcat)
@@ -3265,11 +3383,8 @@ async def execute_delete_item(callback: CallbackQuery):
         
         item_name = item.name
         
-        # Удаляем покупки связанные с позицией
-        db.query(Purchase).filter(Purchase.item_id == item_id).delete()
-        
-        # Удаляем товары
-        db.query(Product).filter(Product.item_id == item_id).delete()
+        # Удаляем покупки, товары и их связи, освобождаем файлы
+        products_service.delete_items_contents(db, [item_id])
         
         # Удаляем позицию
         db.delete(item)
@@ -3351,11 +3466,20 @@ async def show_notifications_menu(callback: CallbackQuery):
         notify_purchase = utils.get_setting(db, "notify_new_purchase", True)
         notify_payment = utils.get_setting(db, "notify_new_payment", True)
         notify_stock = utils.get_setting(db, "notify_out_of_stock", True)
+        digests = {
+            notification_type: utils.get_setting(db, f"notify_{notification_type}_digest", True)
+            for notification_type in notifications.DIGEST_TITLES
+        }
         
         text = "🔔 Управление уведомлениями\n\n"
         text += f"Новая покупка: {'✅' if notify_purchase else '❌'}\n"
         text += f"Новое пополнение: {'✅' if notify_payment else '❌'}\n"
         text += f"Товар закончился: {'✅' if notify_stock else '❌'}\n\n"
+        text += (
+            f"📊 Сводки: при частоте больше {config.NOTIFY_DIGEST_THRESHOLD} уведомлений "
+            f"за {config.NOTIFY_DIGEST_WINDOW} сек. они собираются в одно сообщение "
+            f"раз в {config.NOTIFY_DIGEST_INTERVAL} сек.\n\n"
+        )
         text += "Выберите уведомление для изменения:"
         
         builder = InlineKeyboardBuilder()
@@ -3371,6 +3495,11 @@ async def show_notifications_menu(callback: CallbackQuery):
             text=f"{'✅' if notify_stock else '❌'} Товар закончился",
             callback_data="admin_toggle_notify_stock"
         ))
+        for notification_type, title in notifications.DIGEST_TITLES.items():
+            builder.add(InlineKeyboardButton(
+                text=f"{'✅' if digests[notification_type] else '❌'} Сводки: {title}",
+                callback_data=f"admin_toggle_digest_{notification_type}"
+            ))
         builder.add(InlineKeyboardButton(text="◀️ Назад", callback_data="admin_panel"))
         builder.adjust(1)
         
@@ -3431,6 +3560,29 @@ async def toggle_notify_stock(callback: CallbackQuery):
         db.close()
 
 
+@router.callback_query(F.data.startswith("admin_toggle_digest_"))
+async def toggle_notify_digest(callback: CallbackQuery):
+    """Включить/выключить сводки для типа уведомлений"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Доступ запрещен")
+        return
+    
+    notification_type = callback.data.replace("admin_toggle_digest_", "", 1)
+    if notification_type not in notifications.DIGEST_TITLES:
+        await callback.answer("Неизвестный тип уведомлений")
+        return
+    
+    db = next(get_db())
+    try:
+        key = f"notify_{notification_type}_digest"
+        current = utils.get_setting(db, key, True)
+        utils.set_setting(db, key, not current)
+        await callback.answer(f"✅ Сводки {'включены' if not current else 'выключены'}")
+        await show_notifications_menu(callback)
+    finally:
+        db.close()
+
+
 @router.callback_query(F.data == "admin_panel")
 async def back_to_admin_panel(callback: CallbackQuery):
     """Вернуться в админ-панель"""
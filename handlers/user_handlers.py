@@ -3,21 +3,23 @@
 """
 
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.orm import Session
 from database import (
-    User, Category, Subcategory, Item, Product, Purchase, Payment,
+    User, Purchase, Payment,
     Promocode, PromocodeActivation, get_db
 )
 import keyboards as kb
 import utils
+import catalog
+from services import payments
+from services import purchase as purchase_service
 import config
 from datetime import datetime
 import aiohttp
-import os
 
 
 router = Router()
@@ -43,6 +45,10 @@ def get_or_create_user(db, user_id: int, username: str = None, first_name: str =
             user.first_name = first_name
         if last_name is not None:
             user.last_name = last_name
+        # Пользователь снова пишет боту - значит, снова доступен для рассылок
+        if user.is_reachable is False:
+            user.is_reachable = True
+            user.unreachable_since = None
         db.commit()
     return user
 
@@ -57,22 +63,19 @@ class BlockedUserMiddleware(BaseMiddleware):
         if event.from_user.id in config.ADMIN_IDS:
             return await handler(event, data)
         
-        db = next(get_db())
-        try:
-            is_blocked, block_type, block_reason = utils.check_user_blocked(db, event.from_user.id)
-            if is_blocked:
-                if block_type == 'silent':
-                    # Тихий бан - просто не обрабатываем
-                    return
-                else:
-                    # Обычный бан - показываем сообщение
-                    if isinstance(event, Message):
-                        await utils.send_blocked_message(event.bot, event.chat.id, block_reason)
-                    elif isinstance(event, CallbackQuery) and event.message:
-                        await utils.send_blocked_message(event.bot, event.message.chat.id, block_reason)
-                    return
-        finally:
-            db.close()
+        # Проверка по кэшу в памяти - без сессии БД для обычных пользователей
+        is_blocked, block_type, block_reason = utils.get_user_block(event.from_user.id)
+        if is_blocked:
+            if block_type == 'silent':
+                # Тихий бан - просто не обрабатываем
+                return
+            else:
+                # Обычный бан - показываем сообщение
+                if isinstance(event, Message):
+                    await utils.send_blocked_message(event.bot, event.chat.id, block_reason)
+                elif isinstance(event, CallbackQuery) and event.message:
+                    await utils.send_blocked_message(event.bot, event.message.chat.id, block_reason)
+                return
         
         return await handler(event, data)
 
@@ -89,7 +92,7 @@ async def cmd_start(message: Message, state: FSMContext):
     db = next(get_db())
     try:
         # Проверка блокировки
-        is_blocked, block_type, block_reason = utils.check_user_blocked(db, message.from_user.id)
+        is_blocked, block_type, block_reason = utils.get_user_block(message.from_user.id)
         if is_blocked:
             if block_type == 'silent':
                 # Тихий бан - просто не отвечаем
@@ -191,84 +194,66 @@ async def show_stock(message: Message):
     """Показать наличие товаров"""
     db = next(get_db())
     try:
-        # Получаем все товары с наличием > 0
-        items = db.query(Item).filter(Item.is_visible == True).all()
-        
-        # Фильтруем только те, у которых есть товары в наличии
-        items_with_stock = []
-        for item in items:
-            available_count = db.query(Product).filter(
-                Product.item_id == item.id,
-                Product.is_sold == False
-            ).count()
-            if available_count > 0:
-                items_with_stock.append((item, available_count))
-        
-        if not items_with_stock:
+        # Части текста строятся один раз на версию снимка каталога
+        # (новый снимок появляется после изменения наличия или каталога)
+        parts = catalog.get_rendered(db, ("stock",), build_stock_parts)
+        if not parts:
             await message.answer("📦 Нет товаров в наличии")
             return
         
-        # Сортируем по категории -> подкатегории -> названию
-        def sort_key(item_tuple):
-            item, _ = item_tuple
-            cat_name = ""
-            subcat_name = ""
-            if item.subcategory:
-                cat_name = item.subcategory.category.name if item.subcategory.category else ""
-                subcat_name = item.subcategory.name
-            elif item.category:
-                cat_name = item.category.name
-            return (cat_name, subcat_name, item.name)
-        
-        items_with_stock.sort(key=sort_key)
-        
-        # Формируем текст
-        lines = ["📦 Наличие товаров:\n"]
-        for i, (item, count) in enumerate(items_with_stock, 1):
-            if item.subcategory:
-                cat_name = item.subcategory.category.name if item.subcategory.category else ""
-                path = f"{cat_name} -> {item.subcategory.name} -> {item.name}"
-            elif item.category:
-                path = f"{item.category.name} -> {item.name}"
-            else:
-                path = item.name
-            
-            lines.append(f"{i}. {path}\nЦена: {item.price:.2f} USDT\nКол-во: {count} шт.\n")
-        
-        text = "\n".join(lines)
-        
-        # Разбиваем на части если текст слишком длинный
-        if len(text) > 4000:
-            parts = []
-            current_part = "📦 Наличие товаров:\n\n"
-            for i, (item, count) in enumerate(items_with_stock, 1):
-                if item.subcategory:
-                    cat_name = item.subcategory.category.name if item.subcategory.category else ""
-                    path = f"{cat_name} -> {item.subcategory.name} -> {item.name}"
-                elif item.category:
-                    path = f"{item.category.name} -> {item.name}"
-                else:
-                    path = item.name
-                
-                line = f"{i}. {path}\nЦена: {item.price:.2f} USDT\nКол-во: {count} шт.\n\n"
-                
-                if len(current_part) + len(line) > 4000:
-                    parts.append(current_part)
-                    current_part = line
-                else:
-                    current_part += line
-            
-            if current_part:
-                parts.append(current_part)
-            
-            for part in parts:
-                await message.answer(part)
-        else:
-            await message.answer(text)
+        for part in parts:
+            await message.answer(part)
     finally:
         db.close()
 
 
+def build_stock_parts(snapshot: catalog.CatalogSnapshot) -> tuple:
+    """Текст наличия товаров по снимку каталога, разбитый на сообщения до 4000 символов"""
+    # Позиции с наличием > 0 (по счетчику items.stock_count)
+    items_with_stock = [
+        (item, snapshot.get_item_category_path(item), item.stock_count)
+        for item in snapshot.items_by_id.values()
+        if item.is_visible and item.stock_count > 0
+    ]
+    if not items_with_stock:
+        return ()
+    
+    # Сортируем по категории -> подкатегории -> названию
+    def sort_key(item_tuple):
+        item = item_tuple[0]
+        category, subcategory = snapshot.get_item_parents(item)
+        return (category.name if category else "", subcategory.name if subcategory else "", item.name)
+    
+    items_with_stock.sort(key=sort_key)
+    
+    # Формируем текст
+    lines = ["📦 Наличие товаров:\n"]
+    for i, (item, category_path, count) in enumerate(items_with_stock, 1):
+        path = f"{category_path} -> {item.name}" if category_path else item.name
+        lines.append(f"{i}. {path}\nЦена: {item.price:.2f} USDT\nКол-во: {count} шт.\n")
+    
+    text = "\n".join(lines)
+    if len(text) <= 4000:
+        return (text,)
+    
+    # Разбиваем на части если текст слишком длинный
+    parts = []
+    current_part = "📦 Наличие товаров:\n\n"
+    for i, (item, category_path, count) in enumerate(items_with_stock, 1):
+        path = f"{category_path} -> {item.name}" if category_path else item.name
+        line = f"{i}. {path}\nЦена: {item.price:.2f} USDT\nКол-во: {count} шт.\n\n"
+        
+        if len(current_part) + len(line) > 4000:
+            parts.append(current_part)
+            current_part = line
+        else:
+            current_part += line
+    
+    if current_part:
+        parts.append(current_part)
+    return tuple(parts)
+
+
 @router.message(F.text.in_([config.BUTTONS.get("buy", "🛒 Купить"), "🛒 Купить"]))
 async def show_categories(message: Message):
     """Показать категории"""
@@ -290,7 +275,7 @@ async def show_subcategories(callback: CallbackQuery):
     category_id = int(callback.data.split("_")[1])
     db = next(get_db())
     try:
-        category = db.query(Category).filter(Category.id == category_id).first()
+        category = catalog.get_snapshot(db).get_category(category_id)
         if not category:
             await callback.answer("Категория не найдена")
             return
@@ -323,7 +308,7 @@ async def show_items(callback: CallbackQuery):
     subcategory_id = int(callback.data.split("_")[1])
     db = next(get_db())
     try:
-        subcategory = db.query(Subcategory).filter(Subcategory.id == subcategory_id).first()
+        subcategory = catalog.get_snapshot(db).get_subcategory(subcategory_id)
         if not subcategory:
             await callback.answer("Подкатегория не найдена")
             return
@@ -356,7 +341,8 @@ async def show_item(callback: CallbackQuery):
     item_id = int(callback.data.split("_")[1])
     db = next(get_db())
     try:
-        item = db.query(Item).filter(Item.id == item_id).first()
+        snapshot = catalog.get_snapshot(db)
+        item = snapshot.get_item(item_id)
         if not item:
             await callback.answer("Товар не найден")
             return
@@ -374,20 +360,10 @@ async def show_item(callback: CallbackQuery):
             callback.from_user.first_name,
             callback.from_user.last_name
         )
-        available_count = db.query(Product).filter(
-            Product.item_id == item.id,
-            Product.is_sold == False
-        ).count()
+        available_count = item.stock_count or 0
         
         # Категория -> Подкатегория
-        if item.subcategory and item.subcategory.category:
-            category_full = f"{item.subcategory.category.name} -> {item.subcategory.name}"
-        elif item.subcategory:
-            category_full = item.subcategory.name
-        elif item.category:
-            category_full = item.category.name
-        else:
-            category_full = "Без категории"
+        category_full = snapshot.get_item_category_path(item) or "Без категории"
         
         text = (
             f"💎 Категория: {category_full}\n\n"
@@ -441,20 +417,14 @@ async def show_item_info(callback: CallbackQuery):
     item_id = int(callback.data.split("_")[2])
     db = next(get_db())
     try:
-        item = db.query(Item).filter(Item.id == item_id).first()
+        snapshot = catalog.get_snapshot(db)
+        item = snapshot.get_item(item_id)
         if not item:
             await callback.answer("Товар не найден")
             return
         
         # Категория -> Подкатегория
-        if item.subcategory and item.subcategory.category:
-            category_full = f"{item.subcategory.category.name} -> {item.subcategory.name}"
-        elif item.subcategory:
-            category_full = item.subcategory.name
-        elif item.category:
-            category_full = item.category.name
-        else:
-            category_full = "Без категории"
+        category_full = snapshot.get_item_category_path(item) or "Без категории"
         
         description_block = item.description.strip() if item.description else "Описание отсутствует."
         
@@ -498,16 +468,6 @@ async def process_purchase(callback: CallbackQuery, state: FSMContext):
     
     db = next(get_db())
     try:
-        # Проверка тех. работ
-        if utils.get_setting(db, "maintenance_mode", False):
-            await callback.answer("⚙️ Сейчас тех. работы, покупка невозможна", show_alert=True)
-            return
-        
-        item = db.query(Item).filter(Item.id == item_id).first()
-        if not item:
-            await callback.answer("Товар не найден")
-            return
-        
         user = get_or_create_user(
             db,
             callback.from_user.id,
@@ -515,125 +475,12 @@ async def process_purchase(callback: CallbackQuery, state: FSMContext):
             callback.from_user.first_name,
             callback.from_user.last_name
         )
-        if user.is_blocked:
-            await callback.answer("Пользователь заблокирован")
+        result = await purchase_service.purchase_item(db, callback.bot, user, item_id, quantity)
+        if not result.ok:
+            await callback.answer(result.error_text, show_alert=result.status == 'maintenance')
             return
         
-        # Проверка наличия
-        if item.product_type == 'string':
-            available_products = db.query(Product).filter(
-                Product.item_id == item.id,
-                Product.is_sold == False
-            ).limit(quantity).all()
-            
-            if len(available_products) < quantity:
-                await callback.answer("Недостаточно товара в наличии")
-                return
-        else:
-            available_product = db.query(Product).filter(
-                Product.item_id == item.id,
-                Product.is_sold == False
-            ).first()
-            
-            if not available_product:
-                await callback.answer("Товар закончился")
-                return
-            available_products = [available_product]
-            quantity = 1
-        
-        total_price = item.price * quantity
-        
-        if user.balance < total_price:
-            await callback.answer(config.TEXTS["insufficient_balance"])
-            return
-        
-        # Создание покупки
-        purchase = Purchase(
-            user_id=user.id,
-            item_id=item.id,
-            quantity=quantity,
-            total_price=total_price
-        )
-        db.add(purchase)
-        
-        # Списание баланса
-        user.balance -= total_price
-        
-        # Помечаем товары как проданные
-        if item.product_type == 'string':
-            # Для строковых товаров помечаем все купленные
-            for i, product in enumerate(available_products):
-                product.is_sold = True
-                product.sold_at = datetime.now()
-                if i == 0:
-                    purchase.product_id = product.id
-        else:
-            # Для файловых товаров берем первый
-            product = available_products[0]
-            product.is_sold = True
-            product.sold_at = datetime.now()
-            purchase.product_id = product.id
-        
-        db.commit()
-        
-        # Логирование
-        utils.log_action(db, "purchase", user_id=user.id, data={
-            "item_id": item.id,
-            "quantity": quantity,
-            "total_price": total_price
-        })
-        
-        # Уведомление админу
-        await utils.send_admin_notification(
-            callback.bot,
-            "new_purchase",
-            f"Новая покупка!\nID заказа: {purchase.id}\nТовар: {item.name}\nКол-во: {quantity} шт.\nСумма: {total_price} USDT",
-            user_id=user.user_id,
-            username=user.username
-        )
-        
-        # Формируем ID заказа: подкатегория-товар
-        if item.subcategory:
-            order_id = f"{item.subcategory.name}-{item.name}"
-        elif item.category:
-            order_id = f"{item.category.name}-{item.name}"
-        else:
-            order_id = f"{item.name}"
-        
-        # Выдача товара
-        try:
-            if item.product_type == 'string':
-                # Выдача строк
-                products_text = "\n".join([p.content for p in available_products])
-                await callback.message.answer(
-                    f"✅ Спасибо за покупку!\n\n"
-                    f"🆔 ID заказа: {purchase.id}\n"
-                    f"📋 {order_id}\n\n"
-                    f"📦 Ваш товар:\n\n{products_text}"
-                )
-            else:
-                # Выдача файла
-                await callback.message.answer(
-                    f"✅ Спасибо за покупку!\n\n"
-                    f"🆔 ID заказа: {purchase.id}\n"
-                    f"📋 {order_id}\n\n"
-                    f"📦 Ваш товар:"
-                )
-                product = available_products[0]
-                if product.file_id:
-                    try:
-                        await callback.message.answer_document(product.file_id)
-                    except:
-                        if product.file_path and os.path.exists(product.file_path):
-                            file = FSInputFile(product.file_path)
-                            await callback.message.answer_document(file)
-                elif product.file_path and os.path.exists(product.file_path):
-                    file = FSInputFile(product.file_path)
-                    await callback.message.answer_document(file)
-        except Exception as e:
-            # Если не удалось выдать сразу, пользователь сможет получить через историю
-            pass
-        
+        await purchase_service.deliver_purchase(callback.message, result)
         await callback.answer("Покупка успешна!")
     finally:
         db.close()
@@ -670,21 +517,8 @@ async def process_custom_quantity(message: Message, state: FSMContext):
         data = await state.get_data()
         item_id = data.get("item_id")
         
-        # Обрабатываем покупку напрямую
         db = next(get_db())
         try:
-            # Проверка тех. работ
-            if utils.get_setting(db, "maintenance_mode", False):
-                await message.answer("⚙️ Сейчас тех. работы, покупка невозможна")
-                await state.clear()
-                return
-            
-            item = db.query(Item).filter(Item.id == item_id).first()
-            if not item:
-                await message.answer("Товар не найден")
-                await state.clear()
-                return
-            
             user = get_or_create_user(
                 db,
                 message.from_user.id,
@@ -692,87 +526,13 @@ async def process_custom_quantity(message: Message, state: FSMContext):
                 message.from_user.first_name,
                 message.from_user.last_name
             )
-            if user.is_blocked:
-                await message.answer("Пользователь не найден или заблокирован")
-                await state.clear()
-                return
-            
-            # Проверка наличия
-            available_products = db.query(Product).filter(
-                Product.item_id == item.id,
-                Product.is_sold == False
-            ).limit(quantity).all()
-            
-            if len(available_products) < quantity:
-                await message.answer("Недостаточно товара в наличии")
-                await state.clear()
-                return
-            
-            total_price = item.price * quantity
-            
-            if user.balance < total_price:
-                await message.answer(config.TEXTS["insufficient_balance"])
-                await state.clear()
+            result = await purchase_service.purchase_item(db, message.bot, user, item_id, quantity)
+            await state.clear()
+            if not result.ok:
+                await message.answer(result.error_text)
                 return
             
-            # Создание покупки
-            purchase = Purchase(
-                user_id=user.id,
-                item_id=item.id,
-                quantity=quantity,
-                total_price=total_price
-            )
-            db.add(purchase)
-            
-            # Списание баланса
-            user.balance -= total_price
-            
-            # Помечаем товары как проданные
-            for i, product in enumerate(available_products):
-                product.is_sold = True
-                product.sold_at = datetime.now()
-                if i == 0:
-                    purchase.product_id = product.id
-            
-            db.commit()
-            
-            # Логирование
-            utils.log_action(db, "purchase", user_id=user.id, data={
-                "item_id": item.id,
-                "quantity": quantity,
-                "total_price": total_price
-            })
-            
-            # Уведомление админу
-            await utils.send_admin_notification(
-                message.bot,
-                "new_purchase",
-                f"Новая покупка!\nID заказа: {purchase.id}\nТовар: {item.name}\nКол-во: {quantity} шт.\nСумма: {total_price} USDT",
-                user_id=user.user_id,
-                username=user.username
-            )
-            
-            # Формируем ID заказа: подкатегория-товар
-            if item.subcategory:
-                order_id = f"{item.subcategory.name}-{item.name}"
-            elif item.category:
-                order_id = f"{item.category.name}-{item.name}"
-            else:
-                order_id = f"{item.name}"
-            
-            # Выдача товара
-            try:
-                products_text = "\n".join([p.content for p in available_products])
-                await message.answer(
-                    f"✅ Спасибо за покупку!\n\n"
-                    f"🆔 ID заказа: {purchase.id}\n"
-                    f"📋 {order_id}\n\n"
-                    f"📦 Ваш товар:\n\n{products_text}"
-                )
-            except Exception as e:
-                pass
-            
-            await state.clear()
+            await purchase_service.deliver_purchase(message, result)
         finally:
             db.close()
     except ValueError:
@@ -889,35 +649,18 @@ async def get_purchase_product(callback: CallbackQuery):
             return
         
         item = purchase.item
+        # Товары покупки - одним запросом по индексу purchase_products
+        products = purchase.products
+        if not products and purchase.product:
+            products = [purchase.product]
+        
         if item.product_type == 'string':
-            # Получаем все проданные товары для этой покупки
-            # Берем товары, которые были проданы в момент покупки
-            products = db.query(Product).filter(
-                Product.item_id == item.id,
-                Product.is_sold == True,
-                Product.sold_at <= purchase.created_at
-            ).order_by(Product.sold_at.desc()).limit(purchase.quantity).all()
-            
             if products:
-                products_text = "\n".join([p.content for p in reversed(products)])
+                products_text = "\n".join([p.content for p in products])
                 await callback.message.answer(f"📦 Ваш товар:\n\n{products_text}")
-            else:
-                # Если не нашли по времени, берем любые проданные
-                products = db.query(Product).filter(
-                    Product.item_id == item.id,
-                    Product.is_sold == True
-                ).limit(purchase.quantity).all()
-                if products:
-                    products_text = "\n".join([p.content for p in products])
-                    await callback.message.answer(f"📦 Ваш товар:\n\n{products_text}")
         else:
-            product = purchase.product
-            if product:
-                if product.file_id:
-                    await callback.message.answer_document(product.file_id)
-                elif product.file_path:
-                    file = FSInputFile(product.file_path)
-                    await callback.message.answer_document(file)
+            if products:
+                await purchase_service.send_product_file(callback.message, products[0])
         
         await callback.answer()
     finally:
@@ -1031,7 +774,7 @@ async def process_payment_amount(message: Message, state: FSMContext):
                 f"{config.TEXTS['payment_link']}\n\n"
                 f"💰 Сумма: {amount} USDT\n"
                 f"🔗 Ссылка: {invoice.get('pay_url')}\n\n"
-                f"⏰ У вас есть 15 минут на оплату\n"
+                f"⏰ У вас есть {config.PAYMENT_TTL_MINUTES} минут на оплату\n"
                 f"После оплаты нажмите кнопку 'Проверить платеж'"
             )
             
@@ -1292,7 +1035,7 @@ async def back_to_category(callback: CallbackQuery):
     
     db = next(get_db())
     try:
-        category = db.query(Category).filter(Category.id == category_id).first()
+        category = catalog.get_snapshot(db).get_category(category_id)
         if not category:
             await callback.answer("Категория не найдена")
             return
@@ -1329,7 +1072,7 @@ async def back_to_subcategory(callback: CallbackQuery):
     
     db = next(get_db())
     try:
-        subcategory = db.query(Subcategory).filter(Subcategory.id == subcategory_id).first()
+        subcategory = catalog.get_snapshot(db).get_subcategory(subcategory_id)
         if not subcategory:
             await callback.answer("Подкатегория не найдена")
             return
@@ -1483,10 +1226,15 @@ async def check_payment(callback: CallbackQuery, state: FSMContext):
             await callback.answer("Доступ запрещен")
             return
         
-        # Проверяем время (15 минут)
+        if payment.status in ('expired', 'failed'):
+            await callback.answer("⏰ Время на оплату истекло. Создайте новый платеж.", show_alert=True)
+            await state.clear()
+            return
+        
+        # Проверяем время (срок жизни инвойса)
         from datetime import datetime, timedelta
         time_diff = datetime.now() - payment.created_at
-        if time_diff > timedelta(minutes=15):
+        if payment.status == 'pending' and time_diff > timedelta(minutes=config.PAYMENT_TTL_MINUTES):
             await callback.answer("⏰ Время на оплату истекло. Создайте новый платеж.", show_alert=True)
             await state.clear()
             return
@@ -1497,21 +1245,14 @@ async def check_payment(callback: CallbackQuery, state: FSMContext):
                 invoice_data = await utils.check_cryptobot_invoice(int(payment.cryptobot_invoice_id))
                 
                 if invoice_data and invoice_data.get("status") == "paid":
-                    # Платеж оплачен
-                    if payment.status != 'paid':
-                        payment.status = 'paid'
-                        payment.paid_at = datetime.now()
-                        user.balance += payment.amount
+                    # Платеж оплачен - зачисляем тем же путем, что и фоновая проверка
+                    credited_user = payments.credit_payment(db, payment)
+                    if credited_user:
                         db.commit()
+                        db.refresh(user)
                         
                         # Уведомление админу
-                        await utils.send_admin_notification(
-                            callback.bot,
-                            "new_payment",
-                            f"Новое пополнение!\nСумма: {payment.amount} USDT",
-                            user_id=user.user_id,
-                            username=user.username
-                        )
+                        await payments.notify_payment_credited(callback.bot, payment, user, notify_user=False)
                         
                         await callback.message.edit_text(
                             f"✅ Платеж успешно обработан!\n\n"
@@ -1524,6 +1265,8 @@ async def check_payment(callback: CallbackQuery, state: FSMContext):
                         await callback.answer("✅ Платеж уже обработан", show_alert=True)
                 elif invoice_data and invoice_data.get("status") == "expired":
                     # Платеж истек
+                    if payments.close_payment(db, payment, 'expired'):
+                        db.commit()
                     await callback.answer("⏰ Время на оплату истекло. Создайте новый платеж.", show_alert=True)
                     await state.clear()
                 else:
@@ -4,8 +4,9 @@
 
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
-from database import Button, Category, Subcategory, Item, Product, Promocode
+from database import Button
 from sqlalchemy.orm import Session
+import catalog
 import config
 
 
@@ -62,11 +63,14 @@ def get_admin_panel_keyboard() -> InlineKeyboardMarkup:
 
 
 def get_categories_keyboard(db: Session) -> InlineKeyboardMarkup:
-    """Клавиатура категорий"""
-    categories = db.query(Category).filter(Category.is_visible == True).order_by(Category.position).all()
+    """Клавиатура категорий (из кэша каталога)"""
+    return catalog.get_rendered(db, ("categories",), _build_categories_keyboard)
+
+
+def _build_categories_keyboard(snapshot: catalog.CatalogSnapshot) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
-    for category in categories:
+    for category in snapshot.categories:
         builder.add(InlineKeyboardButton(
             text=category.name,
             callback_data=f"category_{category.id}"
@@ -78,55 +82,30 @@ def get_categories_keyboard(db: Session) -> InlineKeyboardMarkup:
 
 
 def get_subcategories_keyboard(db: Session, category_id: int, hide_out_of_stock: bool = False) -> InlineKeyboardMarkup:
-    """Клавиатура подкатегорий и позиций напрямую в категории"""
-    subcategories = db.query(Subcategory).filter(
-        Subcategory.category_id == category_id,
-        Subcategory.is_visible == True
-    ).order_by(Subcategory.name).all()  # Сортировка по названию
-    
-    # Позиции напрямую в категории (без подкатегории)
-    direct_items = db.query(Item).filter(
-        Item.category_id == category_id,
-        Item.subcategory_id == None,
-        Item.is_visible == True
-    ).order_by(Item.name).all()  # Сортировка по названию
-    
+    """Клавиатура подкатегорий и позиций напрямую в категории (из кэша каталога)"""
+    return catalog.get_rendered(
+        db,
+        ("subcategories", category_id, hide_out_of_stock),
+        lambda snapshot: _build_subcategories_keyboard(snapshot, category_id, hide_out_of_stock)
+    )
+
+
+def _build_subcategories_keyboard(snapshot: catalog.CatalogSnapshot, category_id: int,
+                                  hide_out_of_stock: bool) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
-    # Сначала подкатегории (без эмодзи)
-    for subcategory in subcategories:
+    # Сначала подкатегории (без эмодзи), по названию
+    for subcategory in snapshot.subcategories.get(category_id, []):
         builder.add(InlineKeyboardButton(
             text=subcategory.name,
             callback_data=f"subcategory_{subcategory.id}"
         ))
     
-    # Затем позиции напрямую в категории
-    for item in direct_items:
-        available_count = db.query(Product).filter(
-            Product.item_id == item.id,
-            Product.is_sold == False
-        ).count()
-        
-        price_part = f"{item.price:.2f}$"
-        qty_part = f"{available_count} шт"
-        button_text = f"{item.name} | {price_part} | {qty_part}"
-        
-        if available_count == 0:
-            if hide_out_of_stock:
-                continue
-            if item.out_of_stock_behavior == 'hide':
-                continue
-            elif item.out_of_stock_behavior == 'show_no_button':
-                builder.add(InlineKeyboardButton(
-                    text=button_text,
-                    callback_data=f"item_info_{item.id}"
-                ))
-                continue
-        
-        builder.add(InlineKeyboardButton(
-            text=button_text,
-            callback_data=f"item_{item.id}"
-        ))
+    # Затем позиции напрямую в категории, по названию
+    for item in snapshot.category_items.get(category_id, []):
+        button = _item_button(item, hide_out_of_stock)
+        if button:
+            builder.add(button)
     
     builder.add(InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_categories"))
     builder.adjust(1)
@@ -134,47 +113,24 @@ def get_subcategories_keyboard(db: Session, category_id: int, hide_out_of_stock:
 
 
 def get_items_keyboard(db: Session, subcategory_id: int, hide_out_of_stock: bool = False) -> InlineKeyboardMarkup:
-    """Клавиатура позиций"""
-    subcategory = db.query(Subcategory).filter(Subcategory.id == subcategory_id).first()
-    category_id = subcategory.category_id if subcategory else None
-    
-    items = db.query(Item).filter(
-        Item.subcategory_id == subcategory_id,
-        Item.is_visible == True
-    ).order_by(Item.position).all()
-    
+    """Клавиатура позиций (из кэша каталога)"""
+    return catalog.get_rendered(
+        db,
+        ("items", subcategory_id, hide_out_of_stock),
+        lambda snapshot: _build_items_keyboard(snapshot, subcategory_id, hide_out_of_stock)
+    )
+
+
+def _build_items_keyboard(snapshot: catalog.CatalogSnapshot, subcategory_id: int,
+                          hide_out_of_stock: bool) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     
-    for item in items:
-        # Проверяем наличие товара
-        available_count = db.query(Product).filter(
-            Product.item_id == item.id,
-            Product.is_sold == False
-        ).count()
-        
-        # Формируем текст кнопки: Название | цена | кол-во шт
-        price_part = f"{item.price:.2f}$"
-        qty_part = f"{available_count} шт"
-        button_text = f"{item.name} | {price_part} | {qty_part}"
-        
-        if available_count == 0:
-            # Глобальная настройка скрытия товаров без наличия
-            if hide_out_of_stock:
-                continue
-            if item.out_of_stock_behavior == 'hide':
-                continue
-            elif item.out_of_stock_behavior == 'show_no_button':
-                builder.add(InlineKeyboardButton(
-                    text=button_text,
-                    callback_data=f"item_info_{item.id}"
-                ))
-                continue
-        
-        builder.add(InlineKeyboardButton(
-            text=button_text,
-            callback_data=f"item_{item.id}"
-        ))
+    for item in snapshot.subcategory_items.get(subcategory_id, []):
+        button = _item_button(item, hide_out_of_stock)
+        if button:
+            builder.add(button)
     
+    category_id = snapshot.get_subcategory_category_id(subcategory_id)
     if category_id:
         builder.add(InlineKeyboardButton(text="◀️ Назад", callback_data=f"back_to_category_{category_id}"))
     else:
@@ -183,19 +139,37 @@ def get_items_keyboard(db: Session, subcategory_id: int, hide_out_of_stock: bool
     return builder.as_markup()
 
 
+def _item_button(item, hide_out_of_stock: bool) -> InlineKeyboardButton:
+    """Кнопка позиции: Название | цена | кол-во шт; None - позиция скрыта"""
+    available_count = item.stock_count or 0
+    button_text = f"{item.name} | {item.price:.2f}$ | {available_count} шт"
+    
+    if available_count == 0:
+        # Глобальная настройка скрытия товаров без наличия
+        if hide_out_of_stock:
+            return None
+        if item.out_of_stock_behavior == 'hide':
+            return None
+        elif item.out_of_stock_behavior == 'show_no_button':
+            return InlineKeyboardButton(text=button_text, callback_data=f"item_info_{item.id}")
+    
+    return InlineKeyboardButton(text=button_text, callback_data=f"item_{item.id}")
+
+
 def get_item_keyboard(db: Session, item_id: int, user_balance: float) -> InlineKeyboardMarkup:
-    """Клавиатура товара"""
-    item = db.query(Item).filter(Item.id == item_id).first()
+    """Клавиатура товара (из кэша каталога)"""
+    return catalog.get_rendered(db, ("item", item_id), lambda snapshot: _build_item_keyboard(snapshot, item_id))
+
+
+def _build_item_keyboard(snapshot: catalog.CatalogSnapshot, item_id: int) -> InlineKeyboardMarkup:
+    item = snapshot.get_item(item_id)
     if not item:
         return None
     
     builder = InlineKeyboardBuilder()
     
     # Проверяем наличие
-    available_count = db.query(Product).filter(
-        Product.item_id == item.id,
-        Product.is_sold == False
-    ).count()
+    available_count = item.stock_count or 0
     
     if available_count > 0:
         if item.product_type == 'string':
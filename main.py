@@ -4,14 +4,19 @@
 
 import asyncio
 import logging
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
 
 import config
+import cryptobot
+import notifications
+import webhooks
 from database import init_db
 from handlers import user_handlers, admin_handlers
+from services import broadcast
 
 # Настройка логирования
 logging.basicConfig(
@@ -28,60 +33,34 @@ logger = logging.getLogger(__name__)
 
 async def check_payments(bot: Bot):
     """Периодическая проверка платежей"""
-    from database import SessionLocal, Payment, User
-    from datetime import datetime
-    import utils
+    from services import payments
     
     while True:
         try:
-            db = SessionLocal()
-            try:
-                pending_payments = db.query(Payment).filter(Payment.status == 'pending').all()
-                
-                for payment in pending_payments:
-                    invoice = await utils.check_cryptobot_invoice(int(payment.cryptobot_invoice_id))
-                    
-                    if invoice and invoice.get('status') == 'paid':
-                        payment.status = 'paid'
-                        payment.paid_at = datetime.now()
-                        
-                        user = db.query(User).filter(User.id == payment.user_id).first()
-                        if user:
-                            user.balance += payment.amount
-                            user.total_deposits += payment.amount
-                            
-                            # Уведомление пользователю
-                            try:
-                                await bot.send_message(
-                                    user.user_id,
-                                    f"{config.TEXTS['payment_success']}\n"
-                                    f"Зачислено: {payment.amount:.2f} USDT"
-                                )
-                            except:
-                                pass
-                            
-                            # Уведомление админу
-                            await utils.send_admin_notification(
-                                bot,
-                                "new_payment",
-                                f"Новое пополнение!\nСумма: {payment.amount} USDT",
-                                user_id=user.user_id,
-                                username=user.username
-                            )
-                            
-                            # Логирование
-                            utils.log_action(db, "payment", user_id=user.id, data={
-                                "amount": payment.amount,
-                                "payment_id": payment.id
-                            })
-                
-                db.commit()
-            finally:
-                db.close()
+            await payments.process_pending_payments(bot)
         except Exception as e:
             logger.error(f"Ошибка проверки платежей: {e}")
         
-        await asyncio.sleep(30)  # Проверка каждые 30 секунд
+        await asyncio.sleep(config.PAYMENTS_CHECK_INTERVAL)
+
+
+def create_fsm_storage():
+    """
+    Хранилище состояний диалогов (FSM)
+    FSM_REDIS_URL - общее для всех процессов бота (Redis), иначе память процесса
+    """
+    if config.FSM_REDIS_URL:
+        # redis - необязательная зависимость, нужна только для общего хранилища
+        from aiogram.fsm.storage.redis import RedisStorage
+        logger.info("Состояния диалогов хранятся в Redis")
+        return RedisStorage.from_url(config.FSM_REDIS_URL)
+    
+    if config.BOT_RUN_MODE == "webhook":
+        logger.warning(
+            "Состояния диалогов хранятся в памяти процесса: в режиме webhook "
+            "запускайте один процесс или укажите FSM_REDIS_URL"
+        )
+    return MemoryStorage()
 
 
 async def main():
@@ -108,6 +87,10 @@ async def main():
         channel_id = utils.get_setting(db, "required_channel_id", None)
         if channel_id:
             config.REQUIRED_CHANNEL_ID = channel_id if isinstance(channel_id, int) or (isinstance(channel_id, str) and channel_id.lstrip('-').isdigit()) else channel_id
+        
+        # Загружаем заблокированных пользователей в память
+        utils.load_blocked_users(db)
+        logger.info(f"Загружено заблокированных пользователей: {len(utils.blocked_users)}")
     finally:
         db.close()
     
@@ -116,7 +99,7 @@ async def main():
         token=config.BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=create_fsm_storage())
     
     # Регистрация роутеров
     # Важно: сначала админ-роутер, чтобы админские команды обрабатывались первыми
@@ -131,14 +114,48 @@ async def main():
     # Запуск проверки платежей в фоне
     asyncio.create_task(check_payments(bot))
     
+    # Продолжение рассылок, прерванных перезапуском
+    resumed = broadcast.resume_jobs(bot)
+    if resumed:
+        logger.info(f"Продолжено рассылок: {resumed}")
+    # Рассылки процессов, остановленных во время работы этого
+    asyncio.create_task(broadcast.watch_jobs(bot))
+    
+    # HTTP-сервер: вебхук Telegram (режим webhook) и/или вебхук CryptoBot
+    web_runner = None
+    if config.BOT_RUN_MODE == "webhook" or config.CRYPTOBOT_WEBHOOK_ENABLED:
+        app = web.Application()
+        if config.BOT_RUN_MODE == "webhook":
+            webhooks.setup_telegram_webhook(app, dp, bot)
+        if config.CRYPTOBOT_WEBHOOK_ENABLED:
+            webhooks.setup_cryptobot_webhook(app, bot)
+        web_runner = await webhooks.start_web_server(app)
+    
     # Запуск бота
-    logger.info("Запуск бота...")
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if config.BOT_RUN_MODE == "webhook":
+            logger.info("Запуск бота (webhook)...")
+            await webhooks.set_telegram_webhook(bot, dp)
+            # Обновления приходят через HTTP-сервер - просто ждем остановки
+            await asyncio.Event().wait()
+        else:
+            logger.info("Запуск бота...")
+            # Если раньше бот работал через вебхук, long polling без его удаления не запустится
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     except Exception as e:
         logger.error(f"Ошибка запуска бота: {e}")
         logger.info("Возможно, другой экземпляр бота уже запущен. Остановите его и попробуйте снова.")
         raise
+    finally:
+        if web_runner:
+            await web_runner.cleanup()
+        # Досылаем уведомления админам из очереди
+        await notifications.queue.stop()
+        # Закрываем пул соединений CryptoBot
+        await cryptobot.client.close()
+        # Закрываем соединение с хранилищем состояний
+        await dp.storage.close()
 
 
 if __name__ == "__main__":
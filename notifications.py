@@ -0,0 +1,169 @@
+"""
+Очередь уведомлений админам
+Покупка и зачисление платежа только кладут текст в очередь, отправкой занимается
+фоновый воркер: склеивает накопившиеся уведомления в одно сообщение
+и соблюдает лимиты Telegram
+При всплеске событий уведомления сворачиваются в периодическую сводку
+"""
+
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from aiogram.exceptions import TelegramRetryAfter
+import config
+
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины сообщения Telegram с запасом
+MAX_MESSAGE_LENGTH = 4000
+
+# Заголовки сводок по типам уведомлений
+DIGEST_TITLES = {
+    "new_purchase": "Покупки",
+    "new_payment": "Пополнения",
+    "out_of_stock": "Товар закончился",
+}
+
+
+class NotificationQueue:
+    """Очередь уведомлений админам с фоновым воркером"""
+    
+    def __init__(self):
+        self.bot = None
+        self._queue = None
+        self._worker = None
+        self._digest_task = None
+        self._events = {}  # Тип -> время последних событий (для оценки частоты)
+        self._digests = {}  # Тип -> накопленная сводка
+    
+    def put(self, bot, text: str, notification_type: str = None, digest: bool = False,
+            amount: float = None, item_name: str = None):
+        """
+        Поставить уведомление в очередь (воркер запускается при первом вызове)
+        digest=True - при частоте выше NOTIFY_DIGEST_THRESHOLD событие уходит в сводку
+        """
+        if self._worker is None or self._worker.done():
+            self.bot = bot
+            self._queue = self._queue or asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+            # Цикл сводок мог пережить упавший воркер - второй не нужен
+            if self._digest_task is None or self._digest_task.done():
+                self._digest_task = asyncio.create_task(self._run_digests())
+        
+        if notification_type and digest and self._is_busy(notification_type):
+            self._add_to_digest(notification_type, amount, item_name)
+            return
+        self._queue.put_nowait(text)
+    
+    def _is_busy(self, notification_type: str) -> bool:
+        """Событий этого типа за NOTIFY_DIGEST_WINDOW секунд больше порога"""
+        now = time.monotonic()
+        events = self._events.setdefault(notification_type, deque())
+        events.append(now)
+        while now - events[0] > config.NOTIFY_DIGEST_WINDOW:
+            events.popleft()
+        return len(events) > config.NOTIFY_DIGEST_THRESHOLD
+    
+    def _add_to_digest(self, notification_type: str, amount: float, item_name: str):
+        """Учесть событие в сводке"""
+        digest = self._digests.setdefault(notification_type, {"count": 0, "amount": 0.0, "items": Counter()})
+        digest["count"] += 1
+        digest["amount"] += amount or 0
+        if item_name:
+            digest["items"][item_name] += 1
+    
+    def _flush_digests(self):
+        """Поставить накопленные сводки в очередь"""
+        digests, self._digests = self._digests, {}
+        for notification_type, digest in digests.items():
+            self._queue.put_nowait(format_digest(notification_type, digest))
+    
+    async def _run_digests(self):
+        """Отправка сводок раз в NOTIFY_DIGEST_INTERVAL секунд"""
+        while True:
+            await asyncio.sleep(config.NOTIFY_DIGEST_INTERVAL)
+            self._flush_digests()
+    
+    async def _run(self):
+        """Воркер: пачка уведомлений -> одно сообщение каждому админу"""
+        while True:
+            text = await self._queue.get()
+            stopping = text is None
+            batch = [] if stopping else [text]
+            if not stopping:
+                # Собираем все, что успело накопиться за NOTIFY_BATCH_DELAY
+                await asyncio.sleep(config.NOTIFY_BATCH_DELAY)
+            
+            # При остановке забираем очередь целиком
+            while not self._queue.empty() and (stopping or len(batch) < config.NOTIFY_MAX_BATCH):
+                text = self._queue.get_nowait()
+                if text is None:
+                    stopping = True
+                    continue
+                batch.append(text)
+            
+            for message in split_batch(batch):
+                await self._send_to_admins(message)
+            if stopping:
+                return
+    
+    async def _send_to_admins(self, message: str):
+        """Отправка всем админам с паузой между сообщениями и повтором после RetryAfter"""
+        for admin_id in config.ADMIN_IDS:
+            for _ in range(3):
+                try:
+                    await self.bot.send_message(admin_id, message)
+                    break
+                except TelegramRetryAfter as e:
+                    logger.warning(f"Лимит Telegram при уведомлении админу, ждем {e.retry_after} с")
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки уведомления админу {admin_id}: {e}")
+                    break
+            await asyncio.sleep(config.NOTIFY_SEND_INTERVAL)
+    
+    async def stop(self, timeout: float = 10):
+        """Дослать очередь и остановить воркер (при завершении бота)"""
+        if self._worker is None or self._worker.done():
+            return
+        self._digest_task.cancel()
+        self._flush_digests()
+        self._queue.put_nowait(None)
+        try:
+            await asyncio.wait_for(self._worker, timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не все уведомления админам отправлены до остановки: {self._queue.qsize()}")
+            self._worker.cancel()
+
+
+def format_digest(notification_type: str, digest: dict) -> str:
+    """Текст сводки: количество, сумма и топ позиций"""
+    title = DIGEST_TITLES.get(notification_type, notification_type)
+    text = f"📊 Сводка: {title}\n"
+    text += f"Событий: {digest['count']}\n"
+    if digest["amount"]:
+        text += f"Сумма: {digest['amount']:.2f} USDT\n"
+    if digest["items"]:
+        text += "Топ позиций:\n"
+        for name, count in digest["items"].most_common(config.NOTIFY_DIGEST_TOP_ITEMS):
+            text += f"• {name} - {count}\n"
+    return text.rstrip()
+
+
+def split_batch(texts: list) -> list:
+    """Склеить уведомления в сообщения не длиннее лимита Telegram"""
+    messages = []
+    current = ""
+    for text in texts:
+        if current and len(current) + len(text) + 2 > MAX_MESSAGE_LENGTH:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n\n{text}" if current else text
+    if current:
+        messages.append(current)
+    return messages
+
+
+queue = NotificationQueue()
@@ -0,0 +1,366 @@
+"""
+Рассылки
+Отправка идет в фоне: получатели читаются из БД порциями по id (keyset),
+скорость ограничена общим token bucket, прогресс сохраняется в broadcast_jobs
+после каждой порции - после перезапуска рассылка продолжается с места остановки
+Рассылку отправляет только процесс, записанный в broadcast_jobs.owner: при нескольких
+процессах бота рассылку без живого владельца забирает один из них условным UPDATE
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy import select, func, exists, or_
+from database import BroadcastJob, Purchase, User, SessionLocal
+import utils
+import config
+
+
+logger = logging.getLogger(__name__)
+
+RECIPIENTS_TITLES = {
+    "all": "Всем",
+    "buyers": "Покупавшим",
+    "non_buyers": "Не покупавшим",
+}
+
+
+class TokenBucket:
+    """
+    Ограничитель скорости: не больше rate сообщений в секунду с запасом capacity
+    RetryAfter от Telegram приостанавливает отправку для всех рассылок сразу
+    """
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = asyncio.Lock()
+    
+    def pause(self, seconds: float):
+        """Остановить выдачу токенов на seconds секунд"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+    
+    async def acquire(self):
+        """Дождаться токена на одно сообщение"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Общий лимит Telegram на все рассылки процесса (~30 сообщений в секунду).
+# Лимит на один чат (~1 сообщение в секунду) не достигается - каждый получатель
+# получает одно сообщение за рассылку
+limiter = TokenBucket(config.BROADCAST_RATE, config.BROADCAST_BURST)
+
+# Запущенные рассылки: job_id -> задача
+_tasks = {}
+
+# Этот процесс бота как владелец рассылок (pid повторяется после перезапуска контейнера)
+PROCESS_ID = f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def recipients_query(recipients: str, *columns):
+    """
+    Запрос получателей для фильтра рассылки
+    Пользователи, заблокировавшие бота, исключаются - на них не тратится лимит Telegram
+    Покупки проверяются через EXISTS - проба по индексу purchases.user_id на каждого
+    пользователя вместо сборки списка всех покупателей
+    """
+    has_purchases = exists().where(Purchase.user_id == User.id)
+    query = select(*(columns or (User.id, User.user_id))).where(
+        User.is_blocked == False,
+        User.is_reachable == True
+    )
+    if recipients == "buyers":
+        query = query.where(has_purchases)
+    elif recipients == "non_buyers":
+        query = query.where(~has_purchases)
+    return query
+
+
+def iter_recipient_chunks(recipients: str, after_id: int = 0, chunk_size: int = None):
+    """
+    Telegram ID получателей порциями по users.id (keyset, без OFFSET)
+    Выдает (users.id последнего в порции, [Telegram ID, ...]) - в памяти
+    одновременно только одна порция целых чисел, ORM-объекты не создаются
+    """
+    chunk_size = chunk_size or config.BROADCAST_CHUNK_SIZE
+    while True:
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                recipients_query(recipients)
+                .where(User.id > after_id)
+                .order_by(User.id)
+                .limit(chunk_size)
+            ).all()
+        finally:
+            db.close()
+        if not rows:
+            return
+        after_id = rows[-1][0]
+        yield after_id, [row[1] for row in rows]
+
+
+def create_job(db, admin_id: int, text: str, photo_id: str, recipients: str) -> BroadcastJob:
+    """Создать рассылку и посчитать получателей (с commit)"""
+    total = db.execute(
+        recipients_query(recipients, func.count(User.id))
+    ).scalar()
+    job = BroadcastJob(
+        admin_id=admin_id,
+        text=text,
+        photo_id=photo_id,
+        recipients=recipients,
+        total=total,
+        owner=PROCESS_ID,
+        heartbeat_at=datetime.now()
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def format_progress(job: BroadcastJob) -> str:
+    """Текст прогресса рассылки"""
+    statuses = {
+        "running": "⏳ идет",
+        "done": "✅ завершена",
+        "cancelled": "⛔ остановлена",
+    }
+    text = f"📢 Рассылка #{job.id} ({RECIPIENTS_TITLES.get(job.recipients, job.recipients)})\n"
+    text += f"Статус: {statuses.get(job.status, job.status)}\n"
+    text += f"Обработано: {job.sent + job.failed} из {job.total}\n"
+    text += f"Успешно: {job.sent}\n"
+    text += f"Ошибок: {job.failed}"
+    return text
+
+
+def get_progress_keyboard(job: BroadcastJob) -> InlineKeyboardMarkup:
+    """Кнопка остановки для идущей рассылки"""
+    if job.status != "running":
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="⛔ Остановить", callback_data=f"bcjob_stop_{job.id}")
+    ]])
+
+
+async def update_progress(bot, job: BroadcastJob):
+    """Обновить сообщение с прогрессом у админа"""
+    if not job.progress_chat_id or not job.progress_message_id:
+        return
+    try:
+        await bot.edit_message_text(
+            format_progress(job),
+            chat_id=job.progress_chat_id,
+            message_id=job.progress_message_id,
+            reply_markup=get_progress_keyboard(job)
+        )
+    except Exception as e:
+        # Например, "message is not modified" - прогресс не изменился
+        logger.debug(f"Не удалось обновить прогресс рассылки #{job.id}: {e}")
+
+
+async def send_to_recipient(bot, chat_id: int, text: str, photo_id: str) -> str:
+    """
+    Отправить сообщение рассылки одному получателю с учетом лимита и RetryAfter
+    Возвращает: 'sent', 'unreachable' (бот заблокирован, аккаунт удален) или 'failed'
+    """
+    for _ in range(config.BROADCAST_MAX_RETRIES):
+        await limiter.acquire()
+        try:
+            if photo_id:
+                await bot.send_photo(chat_id, photo_id, caption=text)
+            else:
+                await bot.send_message(chat_id, text)
+            return 'sent'
+        except Exception as e:
+            error_kind = utils.classify_send_error(e)
+            if error_kind == 'retry':
+                logger.warning(f"Лимит Telegram при рассылке, пауза {e.retry_after} с")
+                limiter.pause(e.retry_after)
+                continue
+            if error_kind == 'unreachable':
+                return 'unreachable'
+            logger.debug(f"Ошибка рассылки пользователю {chat_id}: {e}")
+            return 'failed'
+    return 'failed'
+
+
+async def run_job(bot, job_id: int):
+    """Отправка рассылки с сохраненной позиции до конца или до остановки"""
+    db = SessionLocal()
+    try:
+        job = db.get(BroadcastJob, job_id)
+        text, photo_id, recipients, after_id = job.text, job.photo_id, job.recipients, job.last_user_id
+    finally:
+        db.close()
+    
+    semaphore = asyncio.Semaphore(config.BROADCAST_CONCURRENCY)
+    
+    async def send(chat_id: int) -> str:
+        async with semaphore:
+            return await send_to_recipient(bot, chat_id, text, photo_id)
+    
+    last_progress = time.monotonic()
+    for last_id, chat_ids in iter_recipient_chunks(recipients, after_id):
+        results = await asyncio.gather(*(send(chat_id) for chat_id in chat_ids))
+        sent = results.count('sent')
+        unreachable = [chat_id for chat_id, result in zip(chat_ids, results) if result == 'unreachable']
+        
+        db = SessionLocal()
+        try:
+            # Прогресс сохраняется, только пока рассылка принадлежит этому процессу
+            owned = db.query(BroadcastJob).filter(
+                BroadcastJob.id == job_id,
+                BroadcastJob.owner == PROCESS_ID
+            ).update({
+                BroadcastJob.sent: BroadcastJob.sent + sent,
+                BroadcastJob.failed: BroadcastJob.failed + len(results) - sent,
+                BroadcastJob.last_user_id: last_id,
+                BroadcastJob.heartbeat_at: datetime.now()
+            }, synchronize_session=False)
+            # Заблокировавшие бота не попадут в следующие рассылки
+            utils.mark_users_unreachable(db, unreachable)
+            db.commit()
+            if not owned:
+                logger.warning(f"Рассылку #{job_id} забрал другой процесс бота")
+                return
+            job = db.get(BroadcastJob, job_id)
+            if job.status != "running":
+                # Рассылку остановили из админки
+                await update_progress(bot, job)
+                return
+            if time.monotonic() - last_progress >= config.BROADCAST_PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                await update_progress(bot, job)
+        finally:
+            db.close()
+    
+    db = SessionLocal()
+    try:
+        job = db.get(BroadcastJob, job_id)
+        if job.owner != PROCESS_ID:
+            return
+        if job.status == "running":
+            job.status = "done"
+        job.finished_at = datetime.now()
+        db.commit()
+        utils.log_action(db, "admin_action", admin_id=job.admin_id, data={
+            "action": "broadcast",
+            "broadcast_id": job.id,
+            "filter": job.recipients,
+            "success": job.sent,
+            "failed": job.failed
+        })
+        await update_progress(bot, job)
+        try:
+            await bot.send_message(
+                job.admin_id,
+                f"✅ Рассылка #{job.id} завершена!\nУспешно: {job.sent}\nОшибок: {job.failed}"
+            )
+        except Exception:
+            pass
+    finally:
+        db.close()
+
+
+def claim_job(db, job_id: int) -> bool:
+    """
+    Забрать идущую рассылку этому процессу (с commit)
+    Условный UPDATE: забирается рассылка без владельца, своя или та, владелец которой
+    не сохранял прогресс дольше BROADCAST_CLAIM_TIMEOUT (процесс остановлен) -
+    из нескольких процессов рассылку получает только один
+    """
+    now = datetime.now()
+    claimed = db.query(BroadcastJob).filter(
+        BroadcastJob.id == job_id,
+        BroadcastJob.status == "running",
+        or_(
+            BroadcastJob.owner.is_(None),
+            BroadcastJob.owner == PROCESS_ID,
+            BroadcastJob.heartbeat_at < now - timedelta(seconds=config.BROADCAST_CLAIM_TIMEOUT)
+        )
+    ).update({
+        BroadcastJob.owner: PROCESS_ID,
+        BroadcastJob.heartbeat_at: now
+    }, synchronize_session=False)
+    db.commit()
+    return bool(claimed)
+
+
+def start_job(bot, job_id: int) -> bool:
+    """Запустить рассылку в фоне, если ее удалось забрать этому процессу"""
+    if job_id in _tasks and not _tasks[job_id].done():
+        return False
+    db = SessionLocal()
+    try:
+        if not claim_job(db, job_id):
+            return False
+    finally:
+        db.close()
+    task = asyncio.create_task(run_job(bot, job_id))
+    _tasks[job_id] = task
+    task.add_done_callback(lambda t: _on_job_done(job_id, t))
+    return True
+
+
+def _on_job_done(job_id: int, task: asyncio.Task):
+    _tasks.pop(job_id, None)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Рассылка #{job_id} прервана ошибкой: {task.exception()}")
+
+
+def cancel_job(db, job_id: int) -> bool:
+    """Остановить рассылку (отправка прекратится после текущей порции)"""
+    updated = db.query(BroadcastJob).filter(
+        BroadcastJob.id == job_id,
+        BroadcastJob.status == "running"
+    ).update({
+        BroadcastJob.status: "cancelled",
+        BroadcastJob.finished_at: datetime.now()
+    }, synchronize_session=False)
+    db.commit()
+    return bool(updated)
+
+
+def resume_jobs(bot) -> int:
+    """
+    Продолжить рассылки, прерванные перезапуском бота или остановкой другого процесса
+    Запускаются только рассылки, которые удалось забрать; возвращает их количество
+    """
+    db = SessionLocal()
+    try:
+        job_ids = [row[0] for row in db.query(BroadcastJob.id).filter(BroadcastJob.status == "running")]
+    finally:
+        db.close()
+    return sum(start_job(bot, job_id) for job_id in job_ids)
+
+
+async def watch_jobs(bot):
+    """Раз в BROADCAST_CLAIM_TIMEOUT забирать рассылки остановленных процессов"""
+    while True:
+        await asyncio.sleep(config.BROADCAST_CLAIM_TIMEOUT)
+        try:
+            resumed = resume_jobs(bot)
+            if resumed:
+                logger.info(f"Продолжено рассылок остановленных процессов: {resumed}")
+        except Exception as e:
+            logger.error(f"Ошибка проверки рассылок: {e}")
@@ -0,0 +1,206 @@
+"""
+Зачисление платежей CryptoBot
+Общий путь для фоновой проверки платежей и кнопки "Проверить платеж"
+"""
+
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from database import Payment, User, SessionLocal
+import cryptobot
+import utils
+import config
+
+
+logger = logging.getLogger(__name__)
+
+
+async def fetch_invoices(invoice_ids: list) -> tuple[dict, set]:
+    """
+    Статусы инвойсов пачками по CRYPTOBOT_BATCH_SIZE штук за запрос
+    (не больше лимита API на один ответ getInvoices)
+    Возвращает: ({invoice_id: invoice}, ID инвойсов, которые не удалось проверить из-за ошибки)
+    """
+    invoices = {}
+    failed_ids = set()
+    batch_size = min(config.CRYPTOBOT_BATCH_SIZE, cryptobot.MAX_INVOICES_PER_REQUEST)
+    for start in range(0, len(invoice_ids), batch_size):
+        chunk = invoice_ids[start:start + batch_size]
+        try:
+            items = await cryptobot.client.get_invoices(chunk)
+        except Exception as e:
+            # Ошибка одной пачки не мешает проверить остальные
+            logger.error(f"Ошибка получения инвойсов: {e}")
+            items = None
+        if items is None:
+            # Статусы неизвестны (в том числе при ответе API ok: false) - платежи не закрываются
+            failed_ids.update(chunk)
+            continue
+        for invoice in items:
+            invoices[int(invoice["invoice_id"])] = invoice
+    return invoices, failed_ids
+
+
+def credit_payment(db: Session, payment: Payment) -> User:
+    """
+    Пометить платеж оплаченным и зачислить сумму на баланс (без commit)
+    Условный UPDATE по status='pending' защищает от двойного зачисления,
+    если платеж одновременно обрабатывают поллер и пользователь
+    Возвращает пользователя или None, если платеж уже был обработан
+    """
+    updated = db.query(Payment).filter(
+        Payment.id == payment.id,
+        Payment.status == 'pending'
+    ).update({
+        Payment.status: 'paid',
+        Payment.paid_at: datetime.now()
+    }, synchronize_session=False)
+    if not updated:
+        return None
+    
+    db.query(User).filter(User.id == payment.user_id).update({
+        User.balance: User.balance + payment.amount,
+        User.total_deposits: User.total_deposits + payment.amount
+    }, synchronize_session=False)
+    
+    utils.log_action(db, "payment", user_id=payment.user_id, data={
+        "amount": payment.amount,
+        "payment_id": payment.id
+    }, commit=False)
+    
+    return db.query(User).filter(User.id == payment.user_id).first()
+
+
+def close_payment(db: Session, payment: Payment, status: str = 'expired') -> bool:
+    """
+    Закрыть ожидающий платеж статусом expired/failed (без commit)
+    Возвращает False, если платеж уже не в статусе pending
+    """
+    return bool(db.query(Payment).filter(
+        Payment.id == payment.id,
+        Payment.status == 'pending'
+    ).update({Payment.status: status}, synchronize_session=False))
+
+
+def is_payment_stale(payment: Payment) -> bool:
+    """Платеж старше срока жизни инвойса с запасом - больше не может быть оплачен"""
+    deadline = timedelta(minutes=config.PAYMENT_TTL_MINUTES + config.PAYMENT_EXPIRE_GRACE_MINUTES)
+    return datetime.now() - payment.created_at > deadline
+
+
+async def notify_payment_credited(bot, payment: Payment, user: User, notify_user: bool = True):
+    """Уведомления о зачисленном платеже: пользователю и админам"""
+    if notify_user:
+        try:
+            await bot.send_message(
+                user.user_id,
+                f"{config.TEXTS['payment_success']}\n"
+                f"Зачислено: {payment.amount:.2f} USDT"
+            )
+        except Exception as e:
+            if utils.classify_send_error(e) == 'unreachable':
+                db = SessionLocal()
+                try:
+                    utils.mark_users_unreachable(db, [user.user_id])
+                    db.commit()
+                finally:
+                    db.close()
+    
+    await utils.send_admin_notification(
+        bot,
+        "new_payment",
+        f"Новое пополнение!\nСумма: {payment.amount} USDT",
+        user_id=user.user_id,
+        username=user.username,
+        amount=payment.amount
+    )
+
+
+async def process_pending_payments(bot):
+    """
+    Один проход проверки ожидающих платежей:
+    статусы всех инвойсов пачками, зачисление оплаченных и закрытие просроченных одной транзакцией
+    Просроченные платежи проверяются последний раз и переводятся в expired/failed,
+    поэтому в pending остаются только платежи в пределах срока жизни инвойса
+    """
+    db = SessionLocal()
+    try:
+        pending_payments = db.query(Payment).filter(Payment.status == 'pending').all()
+        if not pending_payments:
+            return
+        
+        invoice_ids = [int(p.cryptobot_invoice_id) for p in pending_payments if p.cryptobot_invoice_id]
+        invoices, failed_ids = await fetch_invoices(invoice_ids)
+        
+        credited = []
+        closed = 0
+        for payment in pending_payments:
+            if not payment.cryptobot_invoice_id:
+                # Инвойс так и не был создан
+                closed += close_payment(db, payment, 'failed')
+                continue
+            
+            invoice_id = int(payment.cryptobot_invoice_id)
+            if invoice_id in failed_ids:
+                # Статус неизвестен - проверим на следующем проходе
+                continue
+            
+            invoice = invoices.get(invoice_id)
+            status = invoice.get('status') if invoice else None
+            if status == 'paid':
+                user = credit_payment(db, payment)
+                if user:
+                    credited.append((payment, user))
+            elif status == 'expired':
+                closed += close_payment(db, payment, 'expired')
+            elif is_payment_stale(payment):
+                # Инвойса нет в успешном ответе API или он завис в active дольше срока жизни
+                closed += close_payment(db, payment, 'expired' if invoice else 'failed')
+        
+        if not credited and not closed:
+            return
+        db.commit()
+        if closed:
+            logger.info(f"Закрыто просроченных платежей: {closed}")
+        
+        # Уведомления - только после фиксации транзакции
+        for payment, user in credited:
+            await notify_payment_credited(bot, payment, user)
+    finally:
+        db.close()
+
+
+async def process_paid_invoice(bot, invoice: dict) -> bool:
+    """
+    Зачисление платежа по инвойсу из вебхука CryptoBot
+    Тот же путь, что и у фоновой проверки; повторная доставка вебхука ничего не зачислит
+    Возвращает True, если платеж был зачислен
+    """
+    if invoice.get('status') != 'paid' or not invoice.get('invoice_id'):
+        return False
+    
+    db = SessionLocal()
+    try:
+        payment = db.query(Payment).filter(
+            Payment.cryptobot_invoice_id == str(invoice['invoice_id'])
+        ).first()
+        if not payment or payment.status != 'pending':
+            return False
+        
+        try:
+            amount_matches = abs(float(invoice.get('amount', 0)) - payment.amount) < 1e-9
+        except (TypeError, ValueError):
+            amount_matches = False
+        if not amount_matches:
+            logger.warning(f"Сумма инвойса {invoice['invoice_id']} не совпадает с платежом {payment.id}")
+            return False
+        
+        user = credit_payment(db, payment)
+        if not user:
+            return False
+        db.commit()
+        
+        await notify_payment_credited(bot, payment, user)
+        return True
+    finally:
+        db.close()
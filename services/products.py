@@ -0,0 +1,102 @@
+"""
+Загрузка и удаление товаров
+Строки из .txt читаются потоково и вставляются пачками по UPLOAD_CHUNK_SIZE
+строк на транзакцию - файл не загружается в память целиком
+Дубликаты отсекает уникальный индекс (item_id, content_hash): INSERT OR IGNORE
+"""
+
+import asyncio
+import os
+import time
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+from database import Product, Purchase, PurchaseProduct, content_hash
+import blobstore
+import utils
+import config
+
+
+def read_line_chunks(file_path, chunk_size: int):
+    """
+    Непустые строки файла пачками
+    Выдает (список строк, сколько байт файла прочитано)
+    """
+    chunk = []
+    with open(file_path, 'rb') as f:
+        for raw_line in f:
+            line = raw_line.decode('utf-8', errors='replace').strip()
+            if line:
+                chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk, f.tell()
+                chunk = []
+        if chunk:
+            yield chunk, f.tell()
+
+
+async def import_product_lines(db: Session, item_id: int, file_path, on_progress=None, dedupe: bool = True) -> tuple:
+    """
+    Загрузить строковые товары из файла
+    dedupe=True - строки, уже имеющиеся у позиции (проданные или нет) или повторяющиеся
+    в файле, пропускаются; dedupe=False - загружаются все строки, без хэша
+    Каждая пачка - одна транзакция (вставка + счетчик наличия), при ошибке
+    в базе остаются уже загруженные пачки
+    on_progress(загружено строк, доля файла 0..1) вызывается не чаще UPLOAD_PROGRESS_INTERVAL секунд
+    Возвращает: (загружено новых строк, пропущено дубликатов)
+    """
+    # Вставка через таблицу (Core), а не ORM - нужен rowcount вставленных строк
+    statement = insert(Product.__table__)
+    if dedupe:
+        statement = statement.prefix_with("OR IGNORE")
+    total_size = os.path.getsize(file_path) or 1
+    added = 0
+    duplicates = 0
+    last_progress = time.monotonic()
+    for lines, position in read_line_chunks(file_path, config.UPLOAD_CHUNK_SIZE):
+        rows = [
+            {"item_id": item_id, "content": line, "content_hash": content_hash(line) if dedupe else None}
+            for line in lines
+        ]
+        inserted = db.execute(statement, rows).rowcount
+        utils.change_item_stock(db, item_id, inserted)
+        db.commit()
+        added += inserted
+        duplicates += len(lines) - inserted
+        # Между пачками бот продолжает обрабатывать остальные обновления
+        await asyncio.sleep(0)
+        
+        if on_progress and time.monotonic() - last_progress >= config.UPLOAD_PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            await on_progress(added, position / total_size)
+    return added, duplicates
+
+
+def delete_items_contents(db: Session, item_ids: list):
+    """
+    Удалить покупки и товары позиций перед удалением самих позиций (без commit)
+    Связи покупок с товарами удаляются явно - внешние ключи SQLite не проверяет,
+    а освободившиеся id могут достаться новым покупкам; файлы товаров освобождаются
+    в хранилище, удаляет их /gc_blobs
+    """
+    if not item_ids:
+        return
+    
+    purchase_ids = db.query(Purchase.id).filter(Purchase.item_id.in_(item_ids))
+    product_ids = db.query(Product.id).filter(Product.item_id.in_(item_ids))
+    db.query(PurchaseProduct).filter(
+        PurchaseProduct.purchase_id.in_(purchase_ids.scalar_subquery())
+        | PurchaseProduct.product_id.in_(product_ids.scalar_subquery())
+    ).delete(synchronize_session=False)
+    
+    db.query(Purchase).filter(Purchase.item_id.in_(item_ids)).delete(synchronize_session=False)
+    
+    file_refs = (
+        db.query(Product.file_hash, func.count(Product.id))
+        .filter(Product.item_id.in_(item_ids), Product.file_hash != None)
+        .group_by(Product.file_hash)
+        .all()
+    )
+    for file_hash, count in file_refs:
+        blobstore.release(db, file_hash, count)
+    
+    db.query(Product).filter(Product.item_id.in_(item_ids)).delete(synchronize_session=False)
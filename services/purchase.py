@@ -0,0 +1,235 @@
+"""
+Покупка товаров
+Единый путь покупки для кнопок "Купить" и ввода своего количества:
+проверки, резервирование товаров и списание баланса одной транзакцией,
+уведомление админу и выдача товара
+"""
+
+import os
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from aiogram.types import Message, FSInputFile
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from database import Item, Product, Purchase, PurchaseProduct, User, SessionLocal
+import utils
+import config
+
+
+logger = logging.getLogger(__name__)
+
+# Выдача файловых товаров: по сохраненному file_id / с загрузкой файла с диска
+file_delivery_stats = {"cached": 0, "uploaded": 0}
+
+
+@dataclass
+class PurchaseResult:
+    """Результат покупки: status == 'ok' или код ошибки"""
+    status: str
+    item: Item = None
+    purchase: Purchase = None
+    products: list = field(default_factory=list)
+    
+    @property
+    def ok(self) -> bool:
+        return self.status == 'ok'
+    
+    @property
+    def error_text(self) -> str:
+        """Текст ошибки для пользователя"""
+        if self.status == 'out_of_stock' and self.item and self.item.product_type != 'string':
+            return "Товар закончился"
+        return ERROR_TEXTS.get(self.status, "Ошибка покупки")
+
+
+ERROR_TEXTS = {
+    'maintenance': "⚙️ Сейчас тех. работы, покупка невозможна",
+    'item_not_found': "Товар не найден",
+    'blocked': "Пользователь заблокирован",
+    'insufficient_balance': config.TEXTS["insufficient_balance"],
+    'out_of_stock': "Недостаточно товара в наличии",
+}
+
+
+def buy_products(db: Session, user: User, item: Item, quantity: int) -> tuple:
+    """
+    Атомарная покупка quantity товаров позиции (с commit)
+    Баланс списывается условным UPDATE (balance >= суммы), товары забираются
+    UPDATE ... WHERE is_sold=0 ... RETURNING - два одновременных покупателя
+    не получат одни и те же строки и не уйдут в минус
+    Возвращает: (ошибка или None, покупка, список товаров, остаток позиции)
+    Ошибки: 'insufficient_balance', 'out_of_stock'
+    """
+    total_price = item.price * quantity
+    
+    # Списание баланса - первая запись транзакции, дальше SQLite держит блокировку записи
+    debited = db.execute(
+        update(User)
+        .where(User.id == user.id, User.balance >= total_price)
+        .values(balance=User.balance - total_price)
+    ).rowcount
+    if not debited:
+        db.rollback()
+        return 'insufficient_balance', None, [], None
+    
+    # Резервирование непроданных товаров
+    unsold_ids = (
+        select(Product.id)
+        .where(Product.item_id == item.id, Product.is_sold == False)
+        .order_by(Product.id)
+        .limit(quantity)
+    )
+    products = db.execute(
+        update(Product)
+        .where(Product.id.in_(unsold_ids.scalar_subquery()))
+        .values(is_sold=True, sold_at=datetime.now())
+        .returning(
+            Product.id, Product.content, Product.file_id,
+            Product.file_path, Product.file_hash, Product.file_name
+        )
+    ).all()
+    if len(products) < quantity:
+        # Товара не хватило - откатываем и списание баланса
+        db.rollback()
+        return 'out_of_stock', None, [], None
+    
+    products.sort(key=lambda p: p.id)
+    purchase = Purchase(
+        user_id=user.id,
+        item_id=item.id,
+        product_id=products[0].id,
+        quantity=quantity,
+        total_price=total_price
+    )
+    db.add(purchase)
+    db.flush()
+    
+    # Точные связи покупки с выданными товарами - для повторной выдачи из истории
+    db.add_all([PurchaseProduct(purchase_id=purchase.id, product_id=p.id) for p in products])
+    
+    # Счетчик наличия и лог - в той же транзакции
+    stock_left = utils.change_item_stock(db, item.id, -quantity)
+    utils.log_action(db, "purchase", user_id=user.id, data={
+        "item_id": item.id,
+        "quantity": quantity,
+        "total_price": total_price
+    }, commit=False)
+    
+    db.commit()
+    return None, purchase, products, stock_left
+
+
+async def purchase_item(db: Session, bot, user: User, item_id: int, quantity: int) -> PurchaseResult:
+    """
+    Покупка позиции: проверки, атомарное списание и уведомление админу
+    Товар не выдается - для этого deliver_purchase
+    """
+    if utils.get_setting(db, "maintenance_mode", False):
+        return PurchaseResult('maintenance')
+    
+    item = db.query(Item).filter(Item.id == item_id).first()
+    if not item:
+        return PurchaseResult('item_not_found')
+    if user.is_blocked:
+        return PurchaseResult('blocked', item=item)
+    
+    # Файловые товары продаются по одному
+    if item.product_type != 'string':
+        quantity = 1
+    
+    error, purchase, products, stock_left = buy_products(db, user, item, quantity)
+    if error:
+        return PurchaseResult(error, item=item)
+    
+    await utils.send_admin_notification(
+        bot,
+        "new_purchase",
+        f"Новая покупка!\nID заказа: {purchase.id}\nТовар: {item.name}\nКол-во: {quantity} шт.\nСумма: {purchase.total_price} USDT",
+        user_id=user.user_id,
+        username=user.username,
+        amount=purchase.total_price,
+        item_name=item.name
+    )
+    # Остаток получен в транзакции покупки - уведомляет только покупка, забравшая последний товар
+    if stock_left is not None and stock_left <= 0:
+        await utils.send_admin_notification(
+            bot,
+            "out_of_stock",
+            f"Товар закончился!\nТовар: {item.name}",
+            item_name=item.name
+        )
+    return PurchaseResult('ok', item=item, purchase=purchase, products=products)
+
+
+def get_order_name(item: Item) -> str:
+    """Название заказа: подкатегория-товар"""
+    if item.subcategory:
+        return f"{item.subcategory.name}-{item.name}"
+    if item.category:
+        return f"{item.category.name}-{item.name}"
+    return f"{item.name}"
+
+
+async def deliver_purchase(message: Message, result: PurchaseResult):
+    """
+    Выдача купленного товара в чат
+    Ошибки не пробрасываются - товар всегда можно получить повторно из истории покупок
+    """
+    item = result.item
+    header = (
+        f"✅ Спасибо за покупку!\n\n"
+        f"🆔 ID заказа: {result.purchase.id}\n"
+        f"📋 {get_order_name(item)}\n\n"
+    )
+    try:
+        if item.product_type == 'string':
+            products_text = "\n".join([p.content for p in result.products])
+            await message.answer(f"{header}📦 Ваш товар:\n\n{products_text}")
+            return
+        
+        await message.answer(f"{header}📦 Ваш товар:")
+        await send_product_file(message, result.products[0])
+    except Exception as e:
+        logger.error(f"Ошибка выдачи заказа {result.purchase.id}: {e}")
+
+
+async def send_product_file(message: Message, product) -> bool:
+    """
+    Отправить файл товара в чат
+    Сначала по сохраненному file_id - Telegram не получает файл заново; если file_id нет
+    или он не сработал, файл загружается с диска, а file_id из ответа сохраняется
+    Возвращает False, если файл отправить нечем
+    """
+    if product.file_id:
+        try:
+            await message.answer_document(product.file_id)
+            file_delivery_stats["cached"] += 1
+            return True
+        except Exception as e:
+            logger.warning(f"file_id товара {product.id} не сработал, загружаем файл: {e}")
+    
+    if not product.file_path or not os.path.exists(product.file_path):
+        logger.error(f"Файл товара {product.id} не найден: {product.file_path}")
+        return False
+    sent = await message.answer_document(FSInputFile(product.file_path, filename=product.file_name))
+    file_delivery_stats["uploaded"] += 1
+    save_file_id(product, sent.document.file_id)
+    return True
+
+
+def save_file_id(product, file_id: str):
+    """Запомнить file_id загруженного файла у товара и у всех товаров с тем же файлом"""
+    db = SessionLocal()
+    try:
+        query = db.query(Product)
+        if product.file_hash:
+            query = query.filter(Product.file_hash == product.file_hash)
+        else:
+            query = query.filter(Product.id == product.id)
+        query.update({Product.file_id: file_id}, synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        logger.error(f"Не удалось сохранить file_id товара {product.id}: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,48 @@
+"""
+Общая подготовка тестов: временная БД и каталоги загрузок вместо рабочих
+config подменяется до первого импорта database - движок создается при импорте
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import config
+
+TEST_DIR = Path(tempfile.mkdtemp(prefix="botlogi-tests-"))
+config.DATABASE_PATH = str(TEST_DIR / "test.db")
+config.UPLOADS_DIR = TEST_DIR / "uploads"
+config.BLOBS_DIR = config.UPLOADS_DIR / "blobs"
+config.UPLOADS_DIR.mkdir()
+
+import database
+
+database.init_db()
+
+
+class FakeBot:
+    """Бот без сети: запоминает отправленные сообщения"""
+    
+    def __init__(self):
+        self.sent = []
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def fake_bot():
+    return FakeBot()
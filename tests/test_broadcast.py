@@ -0,0 +1,50 @@
+"""
+Рассылки при нескольких процессах бота: идущую рассылку забирает только один процесс,
+рассылку остановленного процесса (без сохранения прогресса) - следующий
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+import config
+from database import BroadcastJob, User
+from services import broadcast
+
+
+def test_job_claimed_by_one_process(db, fake_bot, monkeypatch):
+    monkeypatch.setattr(config, "BROADCAST_RATE", 1000)
+    db.add(User(user_id=900005, username="reader"))
+    db.commit()
+    
+    monkeypatch.setattr(broadcast, "PROCESS_ID", "process-a")
+    job = broadcast.create_job(db, 1, "hello", None, "all")
+    assert job.owner == "process-a"
+    
+    # Владелец жив - второй процесс рассылку не забирает и не запускает
+    monkeypatch.setattr(broadcast, "PROCESS_ID", "process-b")
+    assert not broadcast.claim_job(db, job.id)
+    
+    async def resume():
+        return broadcast.resume_jobs(fake_bot)
+    
+    assert asyncio.run(resume()) == 0
+    
+    # Владелец давно не сохранял прогресс - рассылку забирает и досылает второй процесс
+    db.query(BroadcastJob).filter(BroadcastJob.id == job.id).update({
+        BroadcastJob.heartbeat_at: datetime.now() - timedelta(seconds=config.BROADCAST_CLAIM_TIMEOUT + 1)
+    })
+    db.commit()
+    assert broadcast.claim_job(db, job.id)
+    asyncio.run(broadcast.run_job(fake_bot, job.id))
+    
+    db.expire_all()
+    job = db.get(BroadcastJob, job.id)
+    assert job.owner == "process-b"
+    assert job.status == "done"
+    assert (900005, "hello") in fake_bot.sent
+    
+    # Прежний владелец после пробуждения прогресс не пишет
+    monkeypatch.setattr(broadcast, "PROCESS_ID", "process-a")
+    sent = job.sent
+    asyncio.run(broadcast.run_job(fake_bot, job.id))
+    db.expire_all()
+    assert db.get(BroadcastJob, job.id).sent == sent
@@ -0,0 +1,49 @@
+"""
+Снимок каталога: изменения, которых сессии процесса не видят (другой процесс бота,
+чистый SQL), попадают в снимок после CONFIG_CACHE_TTL
+"""
+
+from sqlalchemy import text
+import catalog
+import config
+from database import Category, Item
+
+
+def test_snapshot_reloads_after_ttl(db, monkeypatch):
+    category = Category(name="ttl", position=0)
+    db.add(category)
+    db.flush()
+    item = Item(category_id=category.id, name="ttl-item", price=1.0, product_type='string', stock_count=5)
+    db.add(item)
+    db.commit()
+    
+    snapshot = catalog.get_snapshot(db)
+    assert snapshot.get_item(item.id).stock_count == 5
+    
+    # Как запись из другого процесса: события сессий этого процесса ее не видят
+    db.execute(text("UPDATE items SET stock_count = 0 WHERE id = :id"), {"id": item.id})
+    db.commit()
+    assert catalog.get_snapshot(db) is snapshot
+    
+    monkeypatch.setattr(config, "CONFIG_CACHE_TTL", 0)
+    fresh = catalog.get_snapshot(db)
+    assert fresh.version > snapshot.version
+    assert fresh.get_item(item.id).stock_count == 0
+    # Полученный раньше снимок не меняется
+    assert snapshot.get_item(item.id).stock_count == 5
+
+
+def test_ttl_reload_keeps_version_when_unchanged(db, monkeypatch):
+    item = Item(name="ttl-price", price=1.0, product_type='string')
+    db.add(item)
+    db.commit()
+    snapshot = catalog.get_snapshot(db)
+    snapshot.rendered[("test",)] = "built"
+    
+    monkeypatch.setattr(config, "CONFIG_CACHE_TTL", 0)
+    assert catalog.get_snapshot(db) is snapshot
+    assert catalog.get_rendered(db, ("test",), lambda s: "rebuilt") == "built"
+    
+    db.execute(text("UPDATE items SET price = 2.0 WHERE id = :id"), {"id": item.id})
+    db.commit()
+    assert catalog.get_snapshot(db).version == snapshot.version + 1
@@ -0,0 +1,75 @@
+"""
+Вебхук CryptoBot: локальный фейковый CryptoBot шлет подписанные уведомления
+на настоящий aiohttp-сервер с маршрутом из webhooks.setup_cryptobot_webhook
+"""
+
+import asyncio
+import json
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import config
+import notifications
+import webhooks
+from database import Payment, User
+
+TOKEN = "12345:test-token"
+
+
+class FakeCryptoBot:
+    """Отправитель вебхуков, как у CryptoBot: JSON + заголовок crypto-pay-api-signature"""
+    
+    def __init__(self, session: aiohttp.ClientSession, url, token: str):
+        self.session = session
+        self.url = url
+        self.token = token
+    
+    async def post(self, update: dict, token: str = None) -> int:
+        body = json.dumps(update).encode()
+        signature = webhooks.sign_cryptobot_payload(token or self.token, body)
+        async with self.session.post(
+            self.url,
+            data=body,
+            headers={"Content-Type": "application/json", "crypto-pay-api-signature": signature}
+        ) as response:
+            return response.status
+    
+    async def invoice_paid(self, invoice_id: int, amount: float, token: str = None) -> int:
+        return await self.post({
+            "update_id": invoice_id,
+            "update_type": "invoice_paid",
+            "payload": {"invoice_id": invoice_id, "status": "paid", "amount": str(amount)}
+        }, token)
+
+
+def test_invoice_paid_webhook(db, fake_bot, monkeypatch):
+    monkeypatch.setattr(config, "CRYPTOBOT_TOKEN", TOKEN)
+    user = User(user_id=900001, username="payer", balance=0.0, total_deposits=0.0)
+    db.add(user)
+    db.flush()
+    payment = Payment(user_id=user.id, amount=5.0, cryptobot_invoice_id="7001")
+    db.add(payment)
+    db.commit()
+    
+    async def scenario():
+        app = web.Application()
+        webhooks.setup_cryptobot_webhook(app, fake_bot)
+        async with TestServer(app) as server, aiohttp.ClientSession() as session:
+            cryptobot = FakeCryptoBot(session, server.make_url(config.CRYPTOBOT_WEBHOOK_PATH), TOKEN)
+            statuses = [
+                # Подпись чужим токеном
+                await cryptobot.invoice_paid(7001, 5.0, token="other-token"),
+                await cryptobot.invoice_paid(7001, 5.0),
+                # Повторная доставка того же инвойса
+                await cryptobot.invoice_paid(7001, 5.0),
+            ]
+        await notifications.queue.stop()
+        return statuses
+    
+    assert asyncio.run(scenario()) == [401, 200, 200]
+    
+    db.expire_all()
+    assert db.get(Payment, payment.id).status == 'paid'
+    assert db.get(User, user.id).balance == 5.0
+    # Пользователь уведомлен о зачислении один раз
+    assert [chat_id for chat_id, _ in fake_bot.sent if chat_id == user.user_id] == [user.user_id]
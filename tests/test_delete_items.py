@@ -0,0 +1,49 @@
+"""
+Удаление позиций (в том числе вместе с категорией или подкатегорией):
+товары, покупки и связи удаляются, файлы товаров освобождаются и собираются /gc_blobs
+"""
+
+import config
+import blobstore
+from database import Category, Subcategory, Item, Product, Purchase, PurchaseProduct, User
+from services.products import delete_items_contents
+
+
+def test_deleted_items_release_files(db):
+    category = Category(name="delete-me")
+    db.add(category)
+    db.flush()
+    subcategory = Subcategory(category_id=category.id, name="delete-me-sub")
+    db.add(subcategory)
+    db.flush()
+    item = Item(subcategory_id=subcategory.id, name="file-item", price=1.0, product_type='file')
+    user = User(user_id=900006, username="owner")
+    db.add_all([item, user])
+    db.flush()
+    
+    upload = config.UPLOADS_DIR / "delete-me.bin"
+    upload.write_bytes(b"file shared by two products")
+    file_hash = blobstore.put_file(db, upload, move=False)
+    file_hash = blobstore.put_file(db, upload)
+    products = [Product(item_id=item.id, file_hash=file_hash) for _ in range(2)]
+    db.add_all(products)
+    db.flush()
+    purchase = Purchase(user_id=user.id, item_id=item.id, product_id=products[0].id, total_price=1.0)
+    db.add(purchase)
+    db.flush()
+    db.add(PurchaseProduct(purchase_id=purchase.id, product_id=products[0].id))
+    db.commit()
+    
+    item_id, purchase_id = item.id, purchase.id
+    item_ids = [row[0] for row in db.query(Item.id).filter(Item.subcategory_id == subcategory.id)]
+    delete_items_contents(db, item_ids)
+    db.query(Item).filter(Item.id.in_(item_ids)).delete(synchronize_session=False)
+    db.commit()
+    
+    assert db.query(Product).filter(Product.item_id == item_id).count() == 0
+    assert db.query(Purchase).filter(Purchase.item_id == item_id).count() == 0
+    assert db.query(PurchaseProduct).filter(PurchaseProduct.purchase_id == purchase_id).count() == 0
+    
+    removed, freed = blobstore.collect_garbage(db)
+    assert removed >= 1
+    assert not blobstore.blob_path(file_hash).exists()
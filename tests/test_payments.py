@@ -0,0 +1,48 @@
+"""
+Фоновая проверка платежей: просроченный платеж закрывается как failed,
+только если API ответил успешно и инвойса в ответе нет
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+import config
+import cryptobot
+from database import Payment, User
+from services.payments import process_pending_payments
+
+
+def test_api_error_keeps_stale_payment_pending(db, fake_bot, monkeypatch):
+    monkeypatch.setattr(config, "CRYPTOBOT_TOKEN", "12345:test-token")
+    user = User(user_id=900004, username="stale", balance=0.0, total_deposits=0.0)
+    db.add(user)
+    db.flush()
+    payment = Payment(
+        user_id=user.id,
+        amount=3.0,
+        cryptobot_invoice_id="8001",
+        created_at=datetime.now() - timedelta(days=1)
+    )
+    db.add(payment)
+    db.commit()
+    
+    responses = []
+    
+    async def fake_request(api_method, http_method="GET", params=None, data=None):
+        responses.append(params)
+        return result
+    
+    monkeypatch.setattr(cryptobot.client, "request", fake_request)
+    
+    # Ответ API ok: false - статус инвойса неизвестен
+    result = None
+    asyncio.run(process_pending_payments(fake_bot))
+    db.expire_all()
+    assert db.get(Payment, payment.id).status == 'pending'
+    assert responses[-1]["count"] == 1
+    
+    # Успешный ответ без инвойса - платеж закрывается
+    result = {"items": []}
+    asyncio.run(process_pending_payments(fake_bot))
+    db.expire_all()
+    assert db.get(Payment, payment.id).status == 'failed'
+    assert db.get(User, user.id).balance == 0.0
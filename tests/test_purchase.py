@@ -0,0 +1,35 @@
+"""
+Покупка: уведомление "Товар закончился" уходит, только когда покупка
+забирает последний товар позиции
+"""
+
+import asyncio
+import notifications
+from database import Item, Product, User
+from services.purchase import purchase_item
+
+
+def test_out_of_stock_notification(db, fake_bot, monkeypatch):
+    monkeypatch.setattr(notifications.config, "ADMIN_IDS", [1])
+    monkeypatch.setattr(notifications.config, "NOTIFY_BATCH_DELAY", 0)
+    monkeypatch.setattr(notifications.config, "NOTIFY_SEND_INTERVAL", 0)
+    item = Item(name="last-two", price=1.0, product_type='string', stock_count=2)
+    db.add(item)
+    db.flush()
+    db.add_all([Product(item_id=item.id, content=f"line{i}") for i in range(2)])
+    user = User(user_id=900003, username="buyer", balance=10.0)
+    db.add(user)
+    db.commit()
+    
+    async def scenario():
+        results = [await purchase_item(db, fake_bot, user, item.id, 1) for _ in range(3)]
+        await notifications.queue.stop()
+        return [result.status for result in results]
+    
+    assert asyncio.run(scenario()) == ['ok', 'ok', 'out_of_stock']
+    
+    admin_text = "\n\n".join(text for chat_id, text in fake_bot.sent if chat_id == 1)
+    assert admin_text.count("Товар закончился!") == 1
+    assert admin_text.count("Новая покупка!") == 2
+    db.expire_all()
+    assert db.get(Item, item.id).stock_count == 0
@@ -0,0 +1,71 @@
+"""
+Вебхук Telegram: фейковые Update JSON на локальный сервер с маршрутом
+из webhooks.setup_telegram_webhook, проверка секрета и доставки до обработчика
+"""
+
+import asyncio
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+import config
+import webhooks
+
+SECRET = "test-secret_123"
+
+
+def make_update(update_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1700000000,
+            "chat": {"id": 900002, "type": "private"},
+            "from": {"id": 900002, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+def test_telegram_webhook(monkeypatch):
+    monkeypatch.setattr(config, "TELEGRAM_WEBHOOK_SECRET", SECRET)
+    
+    async def scenario():
+        received = []
+        handled = asyncio.Event()
+        router = Router()
+        
+        @router.message()
+        async def on_message(message: Message):
+            received.append(message.text)
+            handled.set()
+        
+        dp = Dispatcher()
+        dp.include_router(router)
+        bot = Bot("123456:TEST-TOKEN")
+        app = web.Application()
+        webhooks.setup_telegram_webhook(app, dp, bot)
+        
+        async with TestServer(app) as server, aiohttp.ClientSession() as session:
+            url = server.make_url(config.TELEGRAM_WEBHOOK_PATH)
+            async with session.post(
+                url,
+                json=make_update(1, "wrong secret"),
+                headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+            ) as response:
+                wrong_status = response.status
+            async with session.post(
+                url,
+                json=make_update(2, "hello"),
+                headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+            ) as response:
+                ok_status = response.status
+            # Обновление обрабатывается в фоне после ответа Telegram
+            await asyncio.wait_for(handled.wait(), 5)
+        return wrong_status, ok_status, received
+    
+    wrong_status, ok_status, received = asyncio.run(scenario())
+    assert wrong_status == 401
+    assert ok_status == 200
+    assert received == ["hello"]
@@ -2,11 +2,14 @@
 Утилиты для бота
 """
 
-import aiohttp
 import json
+import time
 from datetime import datetime
 from database import Log, Setting, User, BotResponse, get_db
 from sqlalchemy.orm import Session
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramNotFound, TelegramBadRequest
+import cryptobot
+import notifications
 import config
 
 
@@ -54,26 +57,19 @@ async def create_cryptobot_invoice(amount: float, user_id: int) -> dict:
     if not config.CRYPTOBOT_TOKEN:
         return None
     
-    url = f"{config.CRYPTOBOT_API_URL}/createInvoice"
-    headers = {
-        "Crypto-Pay-API-Token": config.CRYPTOBOT_TOKEN
-    }
     data = {
         "asset": "USDT",
         "amount": str(amount),
         "description": f"Пополнение баланса для пользователя {user_id}",
         "paid_btn_name": "viewItem",
         "paid_btn_url": f"https://t.me/{config.BOT_TOKEN.split(':')[0]}",
-        "hidden": False
+        "hidden": False,
+        # CryptoBot сам закроет инвойс по истечении срока - оплатить его позже нельзя
+        "expires_in": config.PAYMENT_TTL_MINUTES * 60
     }
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                result = await response.json()
-                if result.get("ok"):
-                    return result.get("result")
-                return None
+        return await cryptobot.client.create_invoice(data)
     except Exception as e:
         print(f"Ошибка создания инвойса: {e}")
         return None
@@ -84,30 +80,18 @@ async def check_cryptobot_invoice(invoice_id: int) -> dict:
     if not config.CRYPTOBOT_TOKEN:
         return None
     
-    url = f"{config.CRYPTOBOT_API_URL}/getInvoices"
-    headers = {
-        "Crypto-Pay-API-Token": config.CRYPTOBOT_TOKEN
-    }
-    params = {
-        "invoice_ids": str(invoice_id)
-    }
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                result = await response.json()
-                if result.get("ok"):
-                    invoices = result.get("result", {}).get("items", [])
-                    if invoices:
-                        return invoices[0]
-                return None
+        invoices = await cryptobot.client.get_invoices([invoice_id])
+        if invoices:
+            return invoices[0]
+        return None
     except Exception as e:
         print(f"Ошибка проверки инвойса: {e}")
         return None
 
 
-def log_action(db: Session, log_type: str, user_id: int = None, admin_id: int = None, data: dict = None):
-    """Логирование действия"""
+def log_action(db: Session, log_type: str, user_id: int = None, admin_id: int = None, data: dict = None, commit: bool = True):
+    """Логирование действия (commit=False - запись в текущей транзакции)"""
     log = Log(
         log_type=log_type,
         user_id=user_id,
@@ -115,20 +99,67 @@ def log_action(db: Session, log_type: str, user_id: int = None, admin_id: int =
         data=json.dumps(data, ensure_ascii=False) if data else None
     )
     db.add(log)
-    db.commit()
+    if commit:
+        db.commit()
+
+
+class TTLCache:
+    """Кэш в памяти процесса с временем жизни записей и счетчиками попаданий"""
+    
+    _MISSING = object()
+    
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = {}
+    
+    def get(self, key):
+        """Значение из кэша или TTLCache._MISSING"""
+        entry = self._data.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return self._MISSING
+    
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+    
+    def invalidate(self, key=None):
+        """Сбросить одну запись или весь кэш"""
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+    
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+# Кэши настроек и ответов бота (общие для всего процесса)
+settings_cache = TTLCache(config.CONFIG_CACHE_TTL)
+bot_responses_cache = TTLCache(config.CONFIG_CACHE_TTL)
 
 
 def get_setting(db: Session, key: str, default=None):
     """Получить настройку"""
-    setting = db.query(Setting).filter(Setting.key == key).first()
-    if setting:
+    cached = settings_cache.get(key)
+    if cached is TTLCache._MISSING:
+        setting = db.query(Setting).filter(Setting.key == key).first()
+        # (найдена ли запись, значение) - отсутствие настройки тоже кэшируется
+        cached = (True, setting.value) if setting else (False, None)
+        settings_cache.set(key, cached)
+    
+    found, value = cached
+    if found:
         try:
             # Пытаемся преобразовать в bool
-            if setting.value.lower() in ['true', 'false']:
-                return setting.value.lower() == 'true'
-            return setting.value
+            if value.lower() in ['true', 'false']:
+                return value.lower() == 'true'
+            return value
         except:
-            return setting.value
+            return value
     return default
 
 
@@ -141,22 +172,64 @@ def set_setting(db: Session, key: str, value):
         setting = Setting(key=key, value=str(value))
         db.add(setting)
     db.commit()
+    settings_cache.set(key, (True, str(value)))
+
+
+def _get_cached_bot_response(db: Session, key: str):
+    """Ответ бота из кэша: (text, photo) или None, если записи нет"""
+    cached = bot_responses_cache.get(key)
+    if cached is TTLCache._MISSING:
+        response = db.query(BotResponse).filter(BotResponse.key == key).first()
+        cached = (response.text, response.photo) if response else None
+        bot_responses_cache.set(key, cached)
+    return cached
+
+
+def invalidate_bot_response(key: str = None):
+    """Сбросить кэш ответа бота (после изменения в админке)"""
+    bot_responses_cache.invalidate(key)
+
+
+def get_config_cache_stats() -> dict:
+    """Счетчики попаданий/промахов кэшей настроек и ответов"""
+    return {
+        "settings": settings_cache.stats(),
+        "bot_responses": bot_responses_cache.stats(),
+    }
 
 
 def get_bot_response(db: Session, key: str, default: str = "") -> str:
     """Получить ответ бота (только текст)"""
-    response = db.query(BotResponse).filter(BotResponse.key == key).first()
-    return response.text if response else default
+    response = _get_cached_bot_response(db, key)
+    return response[0] if response else default
 
 
 def get_bot_response_with_media(db: Session, key: str, default: str = ""):
     """Получить ответ бота с медиа (возвращает tuple: (text, photo_id))"""
-    response = db.query(BotResponse).filter(BotResponse.key == key).first()
+    response = _get_cached_bot_response(db, key)
     if response:
-        return (response.text or default, response.photo)
+        return (response[0] or default, response[1])
     return (default, None)
 
 
+def change_item_stock(db: Session, item_id: int, delta: int):
+    """
+    Изменить счетчик наличия позиции на delta (без commit)
+    Вызывается в той же транзакции, что и изменение products
+    Возвращает новое значение счетчика (None, если позиции нет)
+    """
+    from sqlalchemy import update
+    from database import Item
+    
+    return db.execute(
+        update(Item)
+        .where(Item.id == item_id)
+        .values(stock_count=Item.stock_count + delta)
+        .returning(Item.stock_count)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+
 def format_user_info(user: User, db: Session = None) -> str:
     """Форматирование информации о пользователе"""
     from database import Purchase
@@ -190,6 +263,7 @@ def format_statistics(db: Session) -> str:
     
     total_users = db.query(User).count()
     subscribed_users = db.query(User).filter(User.is_subscribed == True).count()
+    unreachable_users = db.query(User).filter(User.is_reachable == False).count()
     total_purchases = db.query(Purchase).count()
     total_payments = db.query(Payment).filter(Payment.status == 'paid').all()
     total_revenue = sum(p.amount for p in total_payments)
@@ -198,27 +272,106 @@ def format_statistics(db: Session) -> str:
     total_products = db.query(Product).filter(Product.is_sold == False).count()
     sold_products = db.query(Product).filter(Product.is_sold == True).count()
     
+    # Кэш настроек и ответов бота
+    cache_stats = get_config_cache_stats()
+    cache_hits = sum(c["hits"] for c in cache_stats.values())
+    cache_misses = sum(c["misses"] for c in cache_stats.values())
+    
+    # Выдача файлов: по file_id без загрузки / с загрузкой с диска
+    from services.purchase import file_delivery_stats
+    import catalog
+    
     return f"""📊 Статистика
 
 👥 Всего пользователей: {total_users}
 ✅ Подписанных: {subscribed_users}
 ❌ Неподписанных: {total_users - subscribed_users}
+📬 Доступны для рассылки: {total_users - unreachable_users}
+🚫 Заблокировали бота: {unreachable_users}
 🛒 Покупок: {total_purchases}
 💳 Пополнений: {len(total_payments)}
 💰 Выручка: {total_revenue:.2f} USDT
 📦 Товаров в наличии: {total_products}
-✅ Продано товаров: {sold_products}"""
+✅ Продано товаров: {sold_products}
+⚡ Кэш настроек: {cache_hits} попаданий / {cache_misses} промахов
+🗂 Кэш каталога: {catalog.stats['hits']} попаданий / {catalog.stats['misses']} промахов
+📁 Выдача файлов: {file_delivery_stats['cached']} по file_id / {file_delivery_stats['uploaded']} с загрузкой"""
+
+
+# Заблокированные пользователи в памяти: {telegram user_id: (block_type, block_reason)}
+blocked_users = {}
+_blocked_users_loaded_at = None
+
+
+def load_blocked_users(db: Session):
+    """Загрузить список заблокированных пользователей из БД в память"""
+    global _blocked_users_loaded_at
+    rows = db.query(User.user_id, User.block_type, User.block_reason).filter(User.is_blocked == True).all()
+    blocked_users.clear()
+    for user_id, block_type, block_reason in rows:
+        blocked_users[user_id] = (block_type or 'normal', block_reason or '')
+    _blocked_users_loaded_at = time.monotonic()
+
+
+def set_user_blocked(user_id: int, block_type: str, block_reason: str = None):
+    """Отметить пользователя заблокированным в кэше (после commit в БД)"""
+    blocked_users[user_id] = (block_type or 'normal', block_reason or '')
 
 
-def check_user_blocked(db: Session, user_id: int) -> tuple[bool, str, str]:
+def set_user_unblocked(user_id: int):
+    """Убрать пользователя из кэша блокировок (после commit в БД)"""
+    blocked_users.pop(user_id, None)
+
+
+def get_user_block(user_id: int) -> tuple[bool, str, str]:
     """
-    Проверка блокировки пользователя
+    Проверка блокировки по кэшу в памяти (без сессии БД)
+    Кэш перечитывается раз в CONFIG_CACHE_TTL, чтобы подхватить изменения из других процессов
     Возвращает: (is_blocked, block_type, block_reason)
     """
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user or not user.is_blocked:
+    if _blocked_users_loaded_at is None or time.monotonic() - _blocked_users_loaded_at > config.CONFIG_CACHE_TTL:
+        from database import SessionLocal
+        db = SessionLocal()
+        try:
+            load_blocked_users(db)
+        finally:
+            db.close()
+    
+    block = blocked_users.get(user_id)
+    if block is None:
         return (False, None, None)
-    return (True, user.block_type or 'normal', user.block_reason or '')
+    return (True, block[0], block[1])
+
+
+def classify_send_error(error: Exception) -> str:
+    """
+    Классификация ошибки отправки сообщения пользователю:
+    'retry' - лимит Telegram (RetryAfter), отправку можно повторить
+    'unreachable' - бот заблокирован, аккаунт удален или чат не найден - писать бесполезно
+    'error' - прочие ошибки
+    """
+    if isinstance(error, TelegramRetryAfter):
+        return 'retry'
+    if isinstance(error, (TelegramForbiddenError, TelegramNotFound)):
+        return 'unreachable'
+    if isinstance(error, TelegramBadRequest):
+        description = str(error).lower()
+        if any(reason in description for reason in ("chat not found", "user is deactivated", "peer_id_invalid")):
+            return 'unreachable'
+    return 'error'
+
+
+def mark_users_unreachable(db: Session, telegram_ids: list):
+    """Пометить пользователей недоступными - рассылки их пропускают (без commit)"""
+    if not telegram_ids:
+        return
+    db.query(User).filter(
+        User.user_id.in_(telegram_ids),
+        User.is_reachable == True
+    ).update({
+        User.is_reachable: False,
+        User.unreachable_since: datetime.now()
+    }, synchronize_session=False)
 
 
 async def send_blocked_message(bot, chat_id: int, block_reason: str = ""):
@@ -238,8 +391,12 @@ async def send_blocked_message(bot, chat_id: int, block_reason: str = ""):
         db.close()
 
 
-async def send_admin_notification(bot, notification_type: str, message: str, user_id: int = None, username: str = None):
-    """Отправка уведомления админу"""
+async def send_admin_notification(bot, notification_type: str, message: str, user_id: int = None, username: str = None,
+                                  amount: float = None, item_name: str = None):
+    """
+    Уведомление админам (ставится в очередь notifications)
+    amount и item_name попадают в сводку, если уведомления этого типа идут слишком часто
+    """
     from database import SessionLocal, User
     db = SessionLocal()
     try:
@@ -261,11 +418,15 @@ async def send_admin_notification(bot, notification_type: str, message: str, use
             
             full_message = f"🔔 {message}{user_info}"
             
-            for admin_id in config.ADMIN_IDS:
-                try:
-                    await bot.send_message(admin_id, full_message)
-                except:
-                    pass
+            # Отправка - в фоне, вызывающий код не ждет ответа Telegram
+            notifications.queue.put(
+                bot,
+                full_message,
+                notification_type=notification_type,
+                digest=get_setting(db, f"notify_{notification_type}_digest", True),
+                amount=amount,
+                item_name=item_name
+            )
     finally:
         db.close()
 
@@ -0,0 +1,99 @@
+"""
+HTTP-сервер для вебхуков (aiohttp)
+Telegram присылает сюда обновления в режиме webhook,
+CryptoBot - оплаченные инвойсы (зачисление без ожидания фоновой проверки)
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+import config
+from services import payments
+
+
+logger = logging.getLogger(__name__)
+
+
+def sign_cryptobot_payload(token: str, body: bytes) -> str:
+    """
+    Подпись тела вебхука CryptoBot:
+    HMAC-SHA256 от сырого тела запроса, ключ - SHA256 от токена API
+    """
+    secret = hashlib.sha256(token.encode()).digest()
+    return hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+
+def verify_cryptobot_signature(token: str, body: bytes, signature: str) -> bool:
+    """Проверка заголовка crypto-pay-api-signature"""
+    if not token or not signature:
+        return False
+    return hmac.compare_digest(sign_cryptobot_payload(token, body), signature)
+
+
+async def handle_cryptobot_webhook(request: web.Request) -> web.Response:
+    """Обработчик вебхука CryptoBot"""
+    body = await request.read()
+    if not verify_cryptobot_signature(config.CRYPTOBOT_TOKEN, body, request.headers.get("crypto-pay-api-signature")):
+        logger.warning("Вебхук CryptoBot с неверной подписью")
+        return web.Response(status=401)
+    
+    try:
+        update = json.loads(body)
+    except ValueError:
+        return web.Response(status=400)
+    
+    if update.get("update_type") == "invoice_paid":
+        try:
+            await payments.process_paid_invoice(request.app["bot"], update.get("payload") or {})
+        except Exception as e:
+            # 500 - CryptoBot повторит доставку, а поллер все равно подберет платеж
+            logger.error(f"Ошибка обработки вебхука CryptoBot: {e}")
+            return web.Response(status=500)
+    
+    return web.json_response({"ok": True})
+
+
+def setup_cryptobot_webhook(app: web.Application, bot):
+    """Регистрация маршрута вебхука CryptoBot"""
+    app["bot"] = bot
+    app.router.add_post(config.CRYPTOBOT_WEBHOOK_PATH, handle_cryptobot_webhook)
+
+
+def setup_telegram_webhook(app: web.Application, dp, bot):
+    """
+    Регистрация маршрута для обновлений Telegram
+    Запросы без верного заголовка X-Telegram-Bot-Api-Secret-Token отклоняются
+    """
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=config.TELEGRAM_WEBHOOK_SECRET or None
+    ).register(app, path=config.TELEGRAM_WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+
+async def set_telegram_webhook(bot, dp):
+    """Сообщить Telegram адрес вебхука"""
+    if not config.WEBHOOK_BASE_URL:
+        raise RuntimeError("Для режима webhook укажите WEBHOOK_BASE_URL в config.py")
+    
+    url = f"{config.WEBHOOK_BASE_URL.rstrip('/')}{config.TELEGRAM_WEBHOOK_PATH}"
+    await bot.set_webhook(
+        url,
+        secret_token=config.TELEGRAM_WEBHOOK_SECRET or None,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info(f"Вебхук Telegram установлен: {url}")
+
+
+async def start_web_server(app: web.Application) -> web.AppRunner:
+    """Запуск HTTP-сервера на WEBAPP_HOST:WEBAPP_PORT"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBAPP_HOST, config.WEBAPP_PORT)
+    await site.start()
+    logger.info(f"HTTP-сервер вебхуков запущен на {config.WEBAPP_HOST}:{config.WEBAPP_PORT}")
+    return runner